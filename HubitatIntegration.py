@@ -1,50 +1,192 @@
 from mycroft import MycroftSkill, intent_file_handler
-from fuzzywuzzy import fuzz
-import requests
 import json
+import os
 import socket
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from .attribute_store import AttributeStore
+from .command_queue import CommandQueue
+from .catalog import CatalogDiff, DeviceCatalog, parse_groups, stream_devices
+from .fuzzy_index import FuzzyIndex
+from .hub import Hub, parse_hubs
+from .hub_health import AddressCache
+from .metrics import Metrics, timed
+from .routines import Routine, parse_routines
+from .singleflight import SingleFlight
 
 __author__ = "burnsfisher,GonzRon"
 
 
+def endpoint_name(part_url):
+    # Collapse a Maker API URL into the endpoint it calls, e.g. devices/<id>/<command>, for the metrics
+    parts = part_url.split('?')[0].strip('/').split('/')
+    if parts[:2] == ['apps', 'api']:
+        parts = parts[3:]
+    if len(parts) >= 2 and parts[1] != 'all':
+        parts = parts[:1] + ['<id>'] + (['<command>'] if len(parts) > 2 else [])
+    return '/'.join(parts)
+
+
+class IntentContext:
+    # What an intent is about, resolved once up front: the catalog entry the spoken device matched.
+    # Everything after that (commands, modes) is answered from the catalog.
+    __slots__ = ('device',)
+
+    def __init__(self, device):
+        self.device = device
+
+    @property
+    def label(self):
+        return self.device.label
+
+    def supported_modes(self, attr_store):
+        # Thermostat modes rarely change, so the catalog's copy is good enough.  A value pushed by the
+        # hub is used if we have one, but we never ask the hub just for this.
+        found, modes = attr_store.get(self.device.id, 'supportedThermostatModes', self.device.hub)
+        if not found:
+            modes = self.device.attributes.get('supportedThermostatModes')
+        if not isinstance(modes, str):
+            return list(modes or [])
+        return [m.strip().strip('"\'') for m in modes.strip('[]').split(',') if m.strip()]
+
+
 class HubitatIntegration(MycroftSkill):
+    # How long loading the skill's modules took (set by the package) and the longest an intent waits for
+    # the warm-up after startup
+    import_seconds = None
+    warm_up_timeout = 15
+
     def __init__(self):
         super().__init__()
         self.configured = False
-        self.dev_commands_dict = {}
-        self.address = None
+        self.warmed_up = Event()
+        self.settings_lock = Lock()
+        self.initialize_seconds = None
+        # The hubs by name, in the order they were configured.  The first is the default hub.
+        self.hubs = {}
+        self.address_cache = AddressCache()
         self.attr_dict = None
         self.min_fuzz = None
-        self.access_token = None
         self.settings_change_callback = None
-        self.name_dict_present = None
-        self.dev_id_dict = {}
-        self.maker_api_app_id = None
+        # The device catalog is replaced as a whole by update_devices, never edited in place.  Each hub
+        # has its own catalog (a shard) and names are resolved against the catalog they merge into.
+        self.catalog = DeviceCatalog()
+        self.shards = {}
+        # Set once the catalog has been loaded, or the first attempt to load it has failed
+        self.catalog_ready = Event()
+        self.refresh_lock = Lock()
+        self.last_diff = None
+        self.snapshot_checked = False
+        self.attr_index = FuzzyIndex()
+        self.command_pool = None
+        self.command_queue = None
+        self.hub_pool = None
+        self.device_groups = {}
+        self.group_index = FuzzyIndex()
+        # Routines from settings, and the same compiled against the catalog they were compiled for
+        self.routine_specs = {}
+        self.routine_index = FuzzyIndex()
+        self.routines = {}
+        self.routines_catalog = None
+        self.request_timeout = 5
+        self.backup_request_timeout = 10
+        self.attr_store = AttributeStore()
+        self.event_listener = None
+        self.metrics = Metrics()
+        # Identical hub reads and catalog refreshes that overlap share one request
+        self.inflight = SingleFlight()
+
+    @property
+    def dev_id_dict(self):
+        # The device name and its hubitat id number, for anything that wants the whole list
+        return {device.label: device.id for device in self.catalog}
+
+    @property
+    def device_index(self):
+        return self.catalog.index
+
+    @property
+    def default_hub(self):
+        return next(iter(self.hubs.values()), None)
 
     def initialize(self):
-        # This dict will hold the device name and its hubitat id number
-        self.dev_id_dict = {}
-        self.name_dict_present = False
-        # Get a few settings from the Mycroft web site (they are specific to the user site) and
-        # get the current values
+        # Only register for things here so Mycroft can get on with loading the other skills.  The settings
+        # (which look up the hub addresses), the hub sessions and the catalog snapshot are set up on a
+        # warm-up thread, and intents that arrive before it is done wait for it.
+        started = time.perf_counter()
         self.settings_change_callback = self.on_settings_changed
-        self.on_settings_changed()
+        # Anything on the message bus can ask for the timing metrics
+        self.add_event('hubitat.metrics.get', self.handle_metrics_get)
+        self.add_event('hubitat.metrics.dump', self.handle_metrics_dump)
+        self.add_event('hubitat.metrics.reset', self.handle_metrics_reset)
+        # Automations can send commands through the same queue as spoken ones
+        self.add_event('hubitat.device.command', self.handle_device_command)
+        self.initialize_seconds = time.perf_counter() - started
+        Thread(target=self.warm_up, name='hubitat-warmup', daemon=True).start()
+
+    def warm_up(self):
+        # Get a few settings from the Mycroft web site (they are specific to the user site), then load
+        # everything the first intent would otherwise wait for: the catalog snapshot, fuzzywuzzy (through
+        # the indexes built from the settings) and requests with the hub sessions.  The scheduled refresh
+        # then checks the catalog against the hubs, which opens the connections.
+        started = time.perf_counter()
+        try:
+            self.on_settings_changed()
+            if self.configured:
+                self.load_snapshot()
+                for hub in self.hubs.values():
+                    hub.session
+        except Exception as e:
+            self.log.error(f"Warm-up failed: {e}")
+        warm_up_seconds = time.perf_counter() - started
+        for name, seconds in (('skill.import', self.import_seconds), ('skill.initialize', self.initialize_seconds),
+                              ('skill.warm_up', warm_up_seconds)):
+            if seconds is not None:
+                self.metrics.observe(name, seconds)
+        self.log.info(f"Imported in {(self.import_seconds or 0) * 1000:.0f} ms, initialized in "
+                      f"{(self.initialize_seconds or 0) * 1000:.0f} ms, warmed up in {warm_up_seconds * 1000:.0f} ms")
+        self.warmed_up.set()
+
+    def ready(self):
+        # Whether intents can run.  Only the first utterances after startup can arrive before the warm-up
+        # is done, and they wait for it rather than finding the skill unconfigured.
+        if not self.warmed_up.is_set():
+            with self.metrics.timer('intent.warm_up_wait'):
+                self.warmed_up.wait(self.warm_up_timeout)
+        return self.configured
 
     def on_settings_changed(self):
+        # Mycroft can call this while the warm-up is still applying the settings
+        with self.settings_lock:
+            self.apply_settings()
+
+    def apply_settings(self):
         # Fetch the settings from the user account on mycroft.ai
-        self.access_token = {'access_token': self.settings.get('access_token')}
-        self.address = self.settings.get('local_address')
         self.min_fuzz = self.settings.get('minimum_fuzzy_score')
-        self.maker_api_app_id = str(self.settings.get('hubitat_maker_api_app_id'))
+        self.request_timeout = self.settings.get('request_timeout', 5)
+        self.metrics.enabled = str(self.settings.get('enable_metrics', False)).lower() == 'true'
+        self.backup_request_timeout = self.settings.get('backup_request_timeout', 10)
+        # Every call to a hub goes through that hub's pooled keep-alive session, so rebuild them whenever
+        # the settings (and possibly the hubs) change
+        pool_size = self.settings.get('connection_pool_size', 4)
+        workers = self.settings.get('max_parallel_commands', pool_size)
+        unresolved = self.create_hubs(max(pool_size, workers))
+        self.create_command_pool(workers, self.settings.get('command_debounce_ms', 100))
+        self.attr_store.ttl = self.settings.get('attribute_cache_ttl', 30)
+        self.attr_store.push_ttl = self.settings.get('pushed_attribute_ttl', 3600)
+        self.address_cache.ttl = self.settings.get('address_cache_ttl', 300)
+        self.start_event_listener(self.settings.get('event_listener_port', 0))
         # The attributes are a special case.  I want to end up with a dict indexed by attribute
         # name with the contents being the default device.  But I did not want the user to have
         # to specify this in Python syntax.  So I just have the user give CSVs, possibly in quotes,
         # and the convert them to lists and then to a dict.
         attr_name = self.settings.get('attr_name')
         dev_name = self.settings.get('dev_name')
-        self.log.debug(f"Address={self.address},token={self.access_token},app id={self.maker_api_app_id}")
+        self.log.debug(f"Hubs={list(self.hubs.values())}")
 
-        if None not in [self.access_token, self.address, self.min_fuzz, self.maker_api_app_id, attr_name, dev_name]:
+        if self.hubs and None not in [self.min_fuzz, attr_name, dev_name]:
             # Remove quotes
             attr_name = attr_name.replace('"', '').replace("'", "")
             dev_name = dev_name.replace('"', '').replace("'", "")
@@ -59,71 +201,411 @@ class HubitatIntegration(MycroftSkill):
             self.attr_dict = dict(zip(attrs, devs))
             self.attr_dict["testattr"] = "testAttrDev"
             self.log.debug(self.attr_dict)
+            self.attr_index = FuzzyIndex(self.attr_dict, self.min_fuzz)
+            self.device_index.set_min_score(self.min_fuzz)
+            # Named groups of devices for things like "turn off everything downstairs"
+            self.device_groups = parse_groups(self.settings.get('device_groups'))
+            self.group_index = FuzzyIndex(self.device_groups, self.min_fuzz)
+            # Named routines like "movie time: dim living room lamp to 20, turn off kitchen light"
+            self.routine_specs = parse_routines(self.settings.get('routines'))
+            self.routine_index = FuzzyIndex(self.routine_specs, self.min_fuzz)
+            self.routines_catalog = None
 
-            # If the device name is local assume it is fairly slow and change it to a dotted quad
-            try:
-                self.address = socket.gethostbyname(self.address)
-                socket.inet_aton(self.address)
-            except socket.error:
-                self.log.info("Invalid Hostname or IP Address: addr={}".format(self.address))
+            # A hub whose name did not resolve is still there (calls to it fail like calls to a hub that is
+            # down, and the health probe keeps looking it up) so the other hubs keep working.  With no hub
+            # resolving there is nothing to talk to.
+            if len(unresolved) == len(self.hubs):
+                self.configured = False
                 return
 
             self.log.debug(
-                f"Updated settings: access token={self.access_token}, fuzzy={self.min_fuzz}, addr={self.address}, "
-                f"makerApiId={self.maker_api_app_id}, attr dictionary={self.attr_dict}")
+                f"Updated settings: hubs={[f'{h.name}={h.address}/{h.app_id}' for h in self.hubs.values()]}, "
+                f"fuzzy={self.min_fuzz}, attr dictionary={self.attr_dict}")
             self.configured = True
+            self.schedule_catalog_refresh(self.settings.get('catalog_refresh_interval', 15))
+            self.schedule_health_probe(self.settings.get('health_check_interval', 30))
+
+    def create_hubs(self, pool_size):
+        # One Hub (with its own session and circuit breaker) for each configured hub.  Only the single
+        # hub from the original settings falls back to hubitat.local; with several hubs that name
+        # could be any of them.  Returns the names of the hubs whose address did not resolve.
+        configured = parse_hubs(self.settings)
+        hubs = {}
+        for name, address, app_id, token in configured:
+            hubs[name] = Hub(name, address, app_id, token, pool_size,
+                             self.settings.get('breaker_failure_threshold', 3),
+                             self.settings.get('breaker_reset_timeout', 30),
+                             fallback_host="hubitat.local" if len(configured) == 1 else None)
+        # If a hub's name is local assume it is fairly slow and change it to a dotted quad.  The answer
+        # is cached and kept fresh by the health probe.  This happens before the new hubs replace the
+        # old ones so that nothing running meanwhile finds a hub without an address.
+        unresolved = []
+        for hub in hubs.values():
+            try:
+                hub.resolve(self.address_cache, refresh=True)
+            except socket.error:
+                self.log.info(f"Invalid Hostname or IP Address: hub={hub.name}, addr={hub.host}")
+                unresolved.append(hub.name)
+        # Rescans and attribute queries go to every hub at once on these threads
+        hub_pool = ThreadPoolExecutor(max_workers=max(1, len(hubs)), thread_name_prefix='hubitat-hub')
+        self.close_hubs(hubs, hub_pool)
+        if self.event_listener is not None:
+            self.event_listener.default_hub = getattr(self.default_hub, 'name', None)
+        self.log.debug(f"Created sessions for {len(self.hubs)} hubs with pool size {pool_size}")
+        return unresolved
+
+    def close_hubs(self, hubs=None, hub_pool=None):
+        # Close the hubs in use, after putting the given ones (if any) in their place
+        old_hubs, old_pool = self.hubs, self.hub_pool
+        self.hubs, self.hub_pool = hubs or {}, hub_pool
+        for hub in old_hubs.values():
+            hub.close()
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def fan_out(self, func, *args, hubs=None):
+        # Call func(hub, *args) for every hub (or the named ones) at the same time and return the answers
+        # by hub name.  With a single hub there is nothing to wait for in parallel, so it is just called.
+        hubs = [hub for name, hub in self.hubs.items() if hubs is None or name in hubs]
+        if len(hubs) == 1:
+            return {hubs[0].name: func(hubs[0], *args)}
+        futures = [(hub.name, self.hub_pool.submit(func, hub, *args)) for hub in hubs]
+        results = {}
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                self.log.error(f"Hub {name} failed: {e}")
+                results[name] = None
+        return results
+
+    def schedule_catalog_refresh(self, interval):
+        # Keep the device catalog current in the background so intents never wait on a rescan.  The
+        # first refresh happens right away; an interval of 0 minutes means only that one.
+        self.cancel_scheduled_event('HubitatCatalogRefresh')
+        if interval:
+            self.schedule_repeating_event(self.refresh_catalog, 1, int(interval) * 60, name='HubitatCatalogRefresh')
+        else:
+            self.schedule_event(self.refresh_catalog, 1, name='HubitatCatalogRefresh')
+
+    def schedule_health_probe(self, interval):
+        self.cancel_scheduled_event('HubitatHealthProbe')
+        if interval:
+            self.schedule_repeating_event(self.probe_hub, None, int(interval), name='HubitatHealthProbe')
+
+    def probe_hub(self, message=None):
+        # Runs in the background: refresh the cached addresses (the only place DNS is looked up after
+        # startup) and, if a hub's breaker is open, check whether the hub answers again so intents can
+        # use it straight away instead of waiting out the breaker timeout
+        for hub in list(self.hubs.values()):
+            try:
+                if hub.resolve(self.address_cache):
+                    self.log.info(f"Hub {hub.name} address changed to {hub.address}")
+                if hub.fallback_host:
+                    self.address_cache.resolve(hub.fallback_host)
+            except (socket.error, TypeError):
+                pass
+            if not hub.breaker.is_closed:
+                try:
+                    request = hub.session.get("http://" + hub.address + hub.api_url("devices"), params=hub.params,
+                                              timeout=2)
+                    if request.ok:
+                        self.log.info(f"Hub {hub.name} is answering again")
+                        hub.breaker.success()
+                except Exception as e:
+                    self.log.debug(f"Hub {hub.name} still not answering: {e}")
+
+    def refresh_catalog(self, message=None):
+        # Scheduled refresh.  Nobody asked for it, so failures are logged rather than spoken.
+        count = self.update_devices(quiet=True)
+        if self.last_diff is not None and any(self.last_diff):
+            self.log.info(f"Catalog refreshed: {count} devices, {self.describe_diff(self.last_diff)}")
+        # Build the attribute -> devices index now rather than when someone first asks about every device
+        for attr in self.attr_dict or ():
+            self.catalog.reporting(attr)
+        # Likewise compile the routines against the new catalog
+        self.compiled_routines()
+
+    def compiled_routines(self):
+        # The routines with every device resolved against the current catalog.  They are compiled again
+        # only when the catalog has changed, which swaps in a new catalog object.
+        catalog = self.catalog
+        if self.routines_catalog is not catalog:
+            routines = {}
+            for name, specs in self.routine_specs.items():
+                routines[name] = Routine.compile(
+                    name, specs, catalog, lambda device: IntentContext(device).supported_modes(self.attr_store))
+                for problem in routines[name].problems:
+                    self.log.warning(f"Routine {name}: {problem}")
+            self.routines = routines
+            self.routines_catalog = catalog
+        return self.routines
+
+    def wait_for_catalog(self):
+        # Only the very first intent after startup can get here before the catalog is loaded.  The
+        # snapshot from the last run is usually enough; otherwise wait for the load in progress
+        # rather than starting another one, unless no hub is answering anyway.
+        if not self.catalog_ready.is_set():
+            self.load_snapshot()
+        if not self.catalog_ready.is_set() and any(hub.breaker.is_closed for hub in self.hubs.values()):
+            self.catalog_ready.wait(self.request_timeout)
+
+    def hub_devices_known(self):
+        # A name we cannot find only means there is no such device once some hub's devices have been
+        # loaded.  Before that (the hub was down at startup and there was no snapshot) say so instead.
+        if self.shards:
+            return True
+        self.speak_dialog('hub.unreachable')
+        return False
+
+    @property
+    def snapshot_hub(self):
+        # Identifies the hubs a snapshot was taken from, so we never load one from different hubs
+        return ",".join(f"{hub.name}={hub.identity}" for hub in self.hubs.values())
+
+    def load_snapshot(self):
+        # Load the catalog saved by the last run, once.  The background refresh then checks it
+        # against the hub and applies whatever changed while we were not running.
+        with self.refresh_lock:
+            if self.snapshot_checked or self.catalog_ready.is_set():
+                return
+            self.snapshot_checked = True
+            try:
+                with self.file_system.open('catalog.json', 'r') as f:
+                    catalog = DeviceCatalog.from_snapshot(json.load(f), self.snapshot_hub, self.min_fuzz)
+            except (OSError, ValueError, TypeError) as e:
+                self.log.debug(f"No usable catalog snapshot: {e}")
+                return
+            if catalog is not None:
+                self.shards = catalog.split()
+                self.catalog = catalog
+                self.catalog_ready.set()
+                self.log.info(f"Loaded {len(catalog)} devices from the catalog snapshot")
+
+    def save_snapshot(self):
+        # Write to a temporary file and rename it so a crash never leaves half a snapshot behind
+        path = os.path.join(self.file_system.path, 'catalog.json')
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.catalog.to_snapshot(self.snapshot_hub), f, separators=(',', ':'))
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            self.log.error(f"Could not save the catalog snapshot: {e}")
+
+    def create_command_pool(self, workers, debounce_ms=100):
+        # Every command goes through the queue, which holds it for debounce_ms in case a newer one makes it
+        # pointless, and then sends it on these threads, so commands to several devices at once (groups,
+        # rooms) go out in parallel.  The new queue is in place before the old one closes, so an intent
+        # running meanwhile always has a queue to submit to.
+        command_pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix='hubitat-cmd')
+        command_queue = CommandQueue(self.send_queued_command, command_pool, max(0, float(debounce_ms)) / 1000,
+                                     self.metrics)
+        self.close_command_pool(command_pool, command_queue)
+
+    def close_command_pool(self, command_pool=None, command_queue=None):
+        # Close the queue and threads in use, after putting the given ones (if any) in their place.
+        # Commands still waiting in the old queue are sent before its threads go away.
+        old_pool, old_queue = self.command_pool, self.command_queue
+        self.command_pool, self.command_queue = command_pool, command_queue
+        if old_queue is not None:
+            old_queue.close()
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def submit_command(self, key, command, value=None, wait=None):
+        # Queue a command.  If the settings changed between picking up the queue and submitting to it,
+        # the old queue is closed and the command goes to the new one.
+        queue = self.command_queue
+        try:
+            return queue.submit(key, command, value, wait)
+        except RuntimeError:
+            if self.command_queue is None or self.command_queue is queue:
+                raise
+            return self.command_queue.submit(key, command, value, wait)
+
+    def start_event_listener(self, port):
+        # The hub can push every device event to us (the "URL to send device events to by POST" in the
+        # Maker API app).  Port 0 turns this off and attributes are only pulled and cached for a while.
+        port = int(port or 0)
+        if self.event_listener is not None:
+            if self.event_listener.port == port:
+                return
+            self.event_listener.stop()
+            self.event_listener = None
+        if port:
+            from .event_listener import EventListener
+            try:
+                self.event_listener = EventListener(self.attr_store, port,
+                                                    default_hub=getattr(self.default_hub, 'name', None),
+                                                    hub_hosts=self.hub_hosts)
+                self.event_listener.start()
+                self.log.info(f"Listening for Hubitat events on port {port}")
+            except OSError as e:
+                self.log.error(f"Could not listen for Hubitat events on port {port}: {e}")
+                self.event_listener = None
+
+    def hub_hosts(self):
+        # The IP address each hub is at now, which is where its events have to come from
+        return {hub.name: hub.address.partition(':')[0] for hub in self.hubs.values() if hub.address}
+
+    def handle_device_command(self, message):
+        # {"device": "kitchen light", "command": "setLevel", "value": 40} on the message bus.  The device is
+        # matched like a spoken one.  The response says whether the hub took the command, once it has.
+        name = message.data.get('device')
+        command = message.data.get('command')
+        if not self.ready() or not name or not command:
+            self.bus.emit(message.response({'device': name, 'command': command, 'ok': False}))
+            return
+        self.wait_for_catalog()
+        label = name if self.catalog.get(name) else self.device_index.match(name)[0]
+        device = self.catalog.get(label) if label is not None else None
+        if device is None or command not in device.commands:
+            self.bus.emit(message.response({'device': name, 'command': command, 'ok': False}))
+            return
+        future = self.submit_command(device.key, command, message.data.get('value'))
+        future.add_done_callback(lambda f: self.bus.emit(message.response(
+            {'device': device.label, 'command': command, 'ok': self.command_succeeded(f)})))
+
+    def handle_metrics_get(self, message):
+        self.bus.emit(message.response(self.metrics.snapshot()))
+
+    def handle_metrics_dump(self, message):
+        # Write the metrics to a file in the skill's own directory, metrics.json unless another name is
+        # given.  Anything on the message bus can ask for this, so nothing outside that directory is
+        # ever written.
+        directory = os.path.realpath(self.file_system.path)
+        path = os.path.realpath(os.path.join(directory, message.data.get('path') or 'metrics.json'))
+        if os.path.dirname(path) != directory:
+            self.log.error(f"Not writing metrics outside {directory}: {message.data.get('path')}")
+            self.bus.emit(message.response({'path': message.data.get('path'), 'error': "not a file name"}))
+            return
+        try:
+            self.metrics.dump(path)
+            self.bus.emit(message.response({'path': path}))
+        except OSError as e:
+            self.log.error(f"Could not write metrics to {path}: {e}")
+            self.bus.emit(message.response({'path': path, 'error': str(e)}))
+
+    def handle_metrics_reset(self, message):
+        self.metrics.reset()
+
+    def shutdown(self):
+        if self.metrics.enabled:
+            path = os.path.join(self.file_system.path, 'metrics.json')
+            try:
+                self.metrics.dump(path)
+            except OSError as e:
+                self.log.error(f"Could not write metrics to {path}: {e}")
+        self.close_command_pool()
+        if self.event_listener is not None:
+            self.event_listener.stop()
+            self.event_listener = None
+        self.close_hubs()
+        super().shutdown()
 
     def not_configured(self):
         self.log.debug("Cannot Run Intent - Settings not Configured")
+
+    @staticmethod
+    def describe_diff(diff):
+        return f"added={len(diff.added)}, removed={len(diff.removed)}, renamed={len(diff.renamed)}, " \
+               f"changed={len(diff.changed)}"
+
+    @staticmethod
+    def describe_readings(readings):
+        # Boil (device, value) readings down to something short enough to say: the lowest, highest and
+        # average for numbers, otherwise which devices have each value (just how many, if there are lots)
+        try:
+            numbers = sorted((float(value), device.label) for device, value in readings)
+        except (TypeError, ValueError):
+            numbers = None
+        if numbers:
+            average = sum(n for n, _ in numbers) / len(numbers)
+            return 'attr.all.range', {'count': len(numbers), 'min': f"{numbers[0][0]:g}",
+                                      'min_device': numbers[0][1], 'max': f"{numbers[-1][0]:g}",
+                                      'max_device': numbers[-1][1], 'average': f"{round(average, 1):g}"}
+        by_value = {}
+        for device, value in readings:
+            by_value.setdefault(str(value), []).append(device.label)
+        parts = []
+        for value, labels in sorted(by_value.items(), key=lambda item: -len(item[1])):
+            names = " and ".join(sorted(labels)) if len(labels) <= 3 else f"{len(labels)} devices"
+            parts.append(f"{value} for {names}")
+        return 'attr.all.list', {'count': len(readings), 'values': ", ".join(parts)}
+
     #
     # Intent handlers
     #
 
     @intent_file_handler('turn.on.intent')
+    @timed('intent.on')
     def handle_on_intent(self, message):
         # This is for utterances like "turn on the xxx"
-        if self.configured:
+        if self.ready():
             self.handle_on_or_off_intent(message, 'on')
         else:
             self.not_configured()
 
     @intent_file_handler('turn.off.intent')
+    @timed('intent.off')
     def handle_off_intent(self, message):
         # For utterances like "turn off the xxx".  A
-        if self.configured:
+        if self.ready():
             self.handle_on_or_off_intent(message, 'off')
         else:
             self.not_configured()
 
     @intent_file_handler('level.intent')
+    @timed('intent.level')
     def handle_level_intent(self, message):
-        if self.configured:
+        if self.ready():
             # For utterances like "set the xxx to yyy%"
-            try:
-                device = self.get_hub_device_name(message)
-            except:
-                # g_h_d_n speaks a dialog before throwing an error
+            context = self.resolve_intent_device(message)
+            if context is None:
                 return
 
             level = message.data.get('level')
-            supported_modes = [s.strip() for s in self.hub_get_attribute(self.hub_get_device_id(device), "supportedThermostatModes").strip('[]').split(',') if isinstance(s, str)]
+            supported_modes = context.supported_modes(self.attr_store)
             self.log.debug("Set Level Supported Modes: " + str(supported_modes))
             self.log.debug("Level is: " + str(level))
 
-            if level in supported_modes:
-                if self.is_command_available(command='setThermostatMode', device=device):
-                    self.hub_command_devices(self.hub_get_device_id(device), "setThermostatMode", level)
-                else:
-                    self.not_configured()
-            elif self.is_command_available(command='setLevel', device=device):
-                self.hub_command_devices(self.hub_get_device_id(device), "setLevel", level)
-                self.speak_dialog('ok', data={'device': device})
+            command = 'setThermostatMode' if level in supported_modes else 'setLevel'
+            if self.check_command(context, command):
+                self.send_command(context, command, level)
+        else:
+            self.not_configured()
+
+    @intent_file_handler('turn.on.group.intent')
+    @timed('intent.group_on')
+    def handle_group_on_intent(self, message):
+        # "turn on all the lights", "turn on everything in the kitchen"
+        if self.ready():
+            self.handle_group_intent(message, 'on')
+        else:
+            self.not_configured()
+
+    @intent_file_handler('turn.off.group.intent')
+    @timed('intent.group_off')
+    def handle_group_off_intent(self, message):
+        # "turn off all the lights downstairs", "turn off everything upstairs"
+        if self.ready():
+            self.handle_group_intent(message, 'off')
+        else:
+            self.not_configured()
+
+    @intent_file_handler('level.group.intent')
+    @timed('intent.group_level')
+    def handle_group_level_intent(self, message):
+        # "set all the lights in the den to 30 percent"
+        if self.ready():
+            self.handle_group_intent(message, 'setLevel', message.data.get('level'))
         else:
             self.not_configured()
 
     @intent_file_handler('attr.intent')
+    @timed('intent.attr')
     def handle_attr_intent(self, message):
-        if self.configured:
+        if self.ready():
             # This one is for getting device attributes like level or temperature
             try:
                 attr = self.hub_get_attr_name(message.data.get('attr'))
@@ -136,7 +618,8 @@ class HubitatIntegration(MycroftSkill):
                 device = self.get_hub_device_name_from_text(self.attr_dict[attr])
 
             self.log.debug("Found attribute={},device={}".format(attr, device))
-            val = self.hub_get_attribute(self.hub_get_device_id(device), attr)
+            hub_device = self.catalog.find(device) if device is not None else None
+            val = self.hub_get_attribute(hub_device.id, attr, hub_device.hub) if hub_device is not None else None
             if val is None:
                 self.speak_dialog('attr.not.supported', data={'device': device, 'attr': attr})
             else:
@@ -144,28 +627,80 @@ class HubitatIntegration(MycroftSkill):
         else:
             self.not_configured()
 
+    @intent_file_handler('routine.intent')
+    @timed('intent.routine')
+    def handle_routine_intent(self, message):
+        # "Run movie time": every step of a routine from settings, as many at once as can be
+        if self.ready():
+            spoken = message.data.get('routine')
+            name, _ = self.routine_index.match(spoken) if spoken else (None, 0)
+            if name is None:
+                self.speak_dialog('routine.not.found', data={'routine': spoken})
+                return
+            self.wait_for_catalog()
+            routine = self.compiled_routines()[name]
+            results = self.run_routine(routine)
+            count = len(results) + len(routine.problems)
+            failed = len(routine.problems) + sum(1 for r in results if r is None or not r.ok)
+            if failed:
+                self.speak_dialog('routine.partial', data={'routine': name, 'count': count, 'failed': failed})
+            else:
+                self.speak_dialog('routine.ok', data={'routine': name, 'count': count})
+        else:
+            self.not_configured()
+
+    @intent_file_handler('attr.all.intent')
+    @timed('intent.attr_all')
+    def handle_attr_all_intent(self, message):
+        # "What are the temperatures in every room": one attribute from every device that has it, answered
+        # in a single sentence
+        if self.ready():
+            attr = self.hub_get_attr_name(message.data.get('attr'))
+            if attr is None:
+                # hub_get_attr_name has already said so
+                return
+            readings = self.hub_get_attribute_all(attr)
+            self.log.debug(f"Readings of {attr}: {[(d.label, v) for d, v in readings]}")
+            # Offline devices and ones that never reported have no value, which is not worth saying
+            readings = [(device, value) for device, value in readings if value is not None]
+            if not readings:
+                self.speak_dialog('attr.all.none', data={'attr': attr})
+            elif len(readings) == 1:
+                self.speak_dialog('attr', data={'device': readings[0][0].label, 'attr': attr,
+                                                'value': readings[0][1]})
+            else:
+                dialog, data = self.describe_readings(readings)
+                data['attr'] = attr
+                self.speak_dialog(dialog, data=data)
+        else:
+            self.not_configured()
+
     @intent_file_handler('rescan.intent')
+    @timed('intent.rescan')
     def handle_rescan_intent(self, message):
-        if self.configured:
+        if self.ready():
             count = self.update_devices()
-            self.log.info(str(count))
-            self.speak_dialog('rescan', data={'count': count})
+            diff = self.last_diff
+            self.log.info(f"Rescan found {count} devices: {self.describe_diff(diff) if diff else 'no changes'}")
+            self.speak_dialog('rescan', data={'count': count,
+                                              'added': len(diff.added) if diff else 0,
+                                              'removed': len(diff.removed) if diff else 0,
+                                              'renamed': len(diff.renamed) if diff else 0})
         else:
             self.not_configured()
 
     @intent_file_handler('list.devices.intent')
+    @timed('intent.list_devices')
     def handle_list_devices_intent(self, message):
-        if self.configured:
-            if not self.name_dict_present:
-                self.update_devices()
+        if self.ready():
+            self.wait_for_catalog()
             number = 0
-            for hubDev in self.dev_id_dict:
-                ident = self.dev_id_dict[hubDev]
-
+            for hub_dev in self.catalog:
                 # Speak the real devices, but not the test devices
-                if ident[0:6] != '**test':
+                if not hub_dev.is_test:
                     number = number + 1
-                    self.speak_dialog('list.devices', data={'number': str(number), 'name': hubDev, 'id': ident})
+                    self.speak_dialog('list.devices', data={'number': str(number), 'name': hub_dev.label,
+                                                            'id': hub_dev.id})
         else:
             self.not_configured()
 
@@ -174,31 +709,137 @@ class HubitatIntegration(MycroftSkill):
     #
     def handle_on_or_off_intent(self, message, cmd):
         # Used for both on and off
-        try:
-            self.log.debug("In on/off intent with command " + cmd)
-            device = self.get_hub_device_name(message)
-            silence = message.data.get('how')
-        except:
-            # get_hub_device_name speaks the error dialog
+        self.log.debug("In on/off intent with command " + cmd)
+        context = self.resolve_intent_device(message)
+        if context is None:
+            return
+        silence = message.data.get('how')
+
+        if self.check_command(context, cmd):
+            self.send_command(context, cmd, confirm=silence is None)
+
+    def send_command(self, context, command, value=None, confirm=True):
+        # Queue the command and confirm straight away rather than waiting for the hub.  If the hub then
+        # does not take it, report_command says so.  A hub that has stopped answering gets no benefit of
+        # the doubt: the command goes out at once and its answer decides what is said.
+        hub = self.hubs.get(context.device.hub) or self.default_hub
+        optimistic = hub is None or hub.breaker.is_closed
+        future = self.submit_command(context.device.key, command, value, wait=None if optimistic else 0)
+        future.add_done_callback(lambda f: self.report_command(f, context.device, command,
+                                                               confirm and not optimistic))
+        if confirm and optimistic:
+            self.speak_dialog('ok', data={'device': context.label})
+        return future
+
+    def report_command(self, future, device, command, confirm=False):
+        # Called when the hub has answered (or not) a queued command.  Success is only spoken if the
+        # command was not confirmed when it was queued.
+        if self.command_succeeded(future):
+            if confirm:
+                self.speak_dialog('ok', data={'device': device.label})
+        else:
+            self.log.info(f"Command {command} to {device.label} failed")
+            hub = self.hubs.get(device.hub) or self.default_hub
+            if hub is not None and not hub.breaker.is_closed:
+                self.speak_dialog('hub.unreachable')
+            else:
+                self.speak_dialog('command.failed', data={'device': device.label, 'command': command})
+
+    @staticmethod
+    def command_succeeded(future):
+        return not future.cancelled() and future.exception() is None and future.result() is not None
+
+    def send_queued_command(self, key, command, value):
+        # What the command queue calls to actually send a command
+        hub, dev_id = key
+        return self.hub_command_devices(dev_id, command, value, True, hub)
+
+    def handle_group_intent(self, message, cmd, value=None):
+        # Send one command to every device in a group, room or kind of device at the same time and
+        # confirm once for all of them
+        group = message.data.get('group')
+        room = message.data.get('room')
+        spoken = " ".join(w for w in (group, room) if w) or "everything"
+        devices = [d for d in self.resolve_group(group, room) if cmd in d.commands]
+        self.log.debug(f"Group {spoken} is {[d.label for d in devices]}")
+        if not devices:
+            if not self.hub_devices_known():
+                return
+            self.speak_dialog('group.not.found', data={'group': spoken})
             return
+        results = self.hub_command_group(devices, cmd, value)
+        failed = [d.label for d, ok in results if not ok]
+        if failed:
+            self.log.info(f"No answer from {failed} for {cmd}")
+            self.speak_dialog('group.partial', data={'group': spoken, 'count': len(devices),
+                                                     'failed': len(failed)})
+        elif message.data.get('how') is None:
+            self.speak_dialog('group.ok', data={'group': spoken, 'count': len(devices)})
 
-        if self.is_command_available(command=cmd, device=device):
+    def resolve_group(self, group, room):
+        # A group from settings wins, whichever slot it was heard in: "everything downstairs" and "all the
+        # lights downstairs" name it as the room, "turn off downstairs" as the group.  The other words then
+        # narrow it down.  Otherwise the words are matched against Hubitat rooms and labels.
+        self.wait_for_catalog()
+        for named, kind, in_room in ((room, group, None), (group, None, room)):
+            name = self.group_index.match(named)[0] if named else None
+            if name is not None:
+                members = [self.device_index.match(member)[0] for member in self.device_groups[name]]
+                members = [self.catalog.get(label) for label in members if label is not None]
+                return self.catalog.select(kind, in_room, members)
+        return self.catalog.select(group, room)
+
+    def hub_command_group(self, devices, cmd, value=None):
+        # Queue the command for all the devices; the queue sends them in parallel, so the whole group takes
+        # about as long as the slowest device.  Each command goes straight to the hub the device is on.
+        # We wait for the answers, so there is no point holding the commands back for the debounce window.
+        # Returns (device, succeeded) pairs in the order given, once the hubs have answered.
+        futures = [(d, self.submit_command(d.key, cmd, value, wait=0)) for d in devices]
+        results = []
+        for device, future in futures:
             try:
-                self.hub_command_devices(self.hub_get_device_id(device), cmd)
-                if silence is None:
-                    self.speak_dialog('ok', data={'device': device})
-            except:
-                # If command devices throws an error, probably a bad URL
-                self.speak_dialog('url.error')
+                future.exception()
+            except CancelledError:
+                pass
+            if not self.command_succeeded(future):
+                self.log.error(f"Command {cmd} to {device.label} failed")
+            results.append((device, self.command_succeeded(future)))
+        return results
+
+    def run_routine(self, routine):
+        # Steps go through the command queue like any other command, but without the debounce wait since
+        # the next steps are waiting on them.  Returns the StepResults.
+        results = routine.run(lambda step: self.submit_command(step.device.key, step.command, step.value, wait=0),
+                              timeout=self.request_timeout * max(1, len(routine.steps)))
+        for step, result in zip(routine.steps, results):
+            if result is None:
+                self.log.info(f"Routine {routine.name}: {step.text} did not finish")
+            elif result.skipped:
+                self.log.info(f"Routine {routine.name}: {step.text} skipped")
+            else:
+                self.metrics.observe('routine.step', result.seconds)
+                self.log.debug(f"Routine {routine.name}: {step.text} {'ok' if result.ok else 'failed'} "
+                               f"in {result.seconds * 1000:.0f} ms")
+        return results
+
+    def resolve_intent_device(self, message):
+        # Resolve the device in an utterance exactly once and hand back an IntentContext, or None if
+        # there is no such device (the reason has already been spoken).  No hub round-trip is needed.
+        try:
+            device_name = self.get_hub_device_name(message)
+        except:
+            # get_hub_device_name speaks the error dialog
+            return None
+        device = self.catalog.get(device_name) if device_name is not None else None
+        if device is None:
+            return None
+        return IntentContext(device)
 
-    def is_command_available(self, device, command):
-        # Complain if the specified attribute is not one in the Hubitat maker app.
-        if not self.dev_commands_dict:
-            self.update_devices()
-        for real_dev, commands in self.dev_commands_dict.items():
-            if device.find(real_dev) >= 0 and command in commands:
-                return True
-        self.speak_dialog('command.not.supported', data={'device': device, 'command': command})
+    def check_command(self, context, command):
+        # Complain if the device does not have the command in the Hubitat maker app
+        if command in context.device.commands:
+            return True
+        self.speak_dialog('command.not.supported', data={'device': context.label, 'command': command})
         return False
 
     def get_hub_device_name(self, message):
@@ -218,76 +859,82 @@ class HubitatIntegration(MycroftSkill):
         # The text may have something a bit different than the real name like "the light" or "lights" rather
         # than the actual Hubitat name of light.  This finds the actual Hubitat name using 'fuzzy-wuzzy' and
         # the match score specified as a setting by the user
-        if not self.name_dict_present:
-            # In case we never got the devices
-            self.update_devices()
-
-        # Here we compare all the Hubitat devices against the requested device using fuzzy and take
-        # the device with the highest score that exceeds the minimum
-        best_name = None
-        best_score = self.min_fuzz
-        for hub_dev in self.dev_id_dict:
-            score = fuzz.token_sort_ratio(hub_dev, text)
-            self.log.debug("Hubitat=" + hub_dev + ", utterance=" + text + " score=" + str(score))
-            if score > best_score:
-                best_score = score
-                best_name = hub_dev
+        self.wait_for_catalog()
+
+        # Here we compare all the Hubitat devices against the requested device using the prebuilt fuzzy
+        # index and take the device with the highest score that exceeds the minimum
+        with self.metrics.timer('resolve.device'):
+            best_name, best_score = self.device_index.match(text, self.metrics, 'resolve.device_cache')
         self.log.debug("Best score is " + str(best_score))
-        if best_score > self.min_fuzz:
+        if best_name is not None:
             self.log.debug("Changed " + text + " to " + best_name)
             return best_name
 
         # Nothing had a high enough score.  Speak and throw.
         self.log.debug("No device found for " + text)
+        if not self.hub_devices_known():
+            return
         self.speak_dialog('device.not.supported', data={'device': text})
         self.log.error("Unsupported Device")
 
-    def hub_get_device_id(self, device):
-        # devIds is a dict with the device name from hubitat as the key, and the ID number as the value.
-        # This returns the ID number to send to hubitat
-        for hub_dev, hub_id in self.dev_id_dict.items():
-            # self.log.debug("hubDev:"+hubDev+" device="+device)
-            if device.find(hub_dev) >= 0:
-                self.log.debug("Found device I said: " + hub_dev + " ID=" + hub_id)
-                return hub_id
-
     def hub_get_attr_name(self, name):
         # This is why we need a list of possible attributes.  Otherwise we could not do a fuzzy search.
-        best_name = None
-        best_score = self.min_fuzz
-        self.log.debug(self.attr_dict)
-        attr = None
-
-        for attr in self.attr_dict:
-            self.log.debug("attr is {}".format(attr))
-            score = fuzz.token_sort_ratio(attr, name)
-            # self.log.info("Hubitat="+hubDev+", utterance="+text+" score="+str(score))
-            if score > best_score:
-                best_score = score
-                best_name = attr
+        with self.metrics.timer('resolve.attr'):
+            best_name, best_score = self.attr_index.match(name, self.metrics, 'resolve.attr_cache')
 
         self.log.debug("Best score is " + str(best_score))
-        if best_score > self.min_fuzz:
-            self.log.debug("Changed " + attr + " to " + best_name)
+        if best_name is not None:
+            self.log.debug("Changed " + name + " to " + best_name)
             return best_name
         else:
             self.log.debug("No device found for " + name)
             self.speak_dialog('attr.not.supported', data={'device': 'any device in settings', 'attr': name})
             self.log.error(f"Unsupported Attribute for {name}")
 
-    def hub_command_devices(self, dev_id, state, value=None):
-        # Build a URL to send the requested command to the Hubitat and
-        # send it via "access_hubitat".  Some commands also have a value like "setlevel"
+    def hub_command_devices(self, dev_id, state, value=None, quiet=False, hub=None):
+        # Build a URL to send the requested command to the Hubitat the device is on (the default hub if
+        # none is given) and send it via "access_hubitat".  Some commands also have a value like "setlevel".
+        # Returns the hub's answer, or None if the hub could not be reached.
         if dev_id[0:6] == "**test":
             # This is used for regression tests only
-            return
-        url = "/apps/api/" + self.maker_api_app_id + "/devices/" + dev_id + "/" + state  # This URL is as specified in Hubitat maker app
-        if value:
-            url = url + "/" + value
+            return ""
+        hub = self.hubs.get(hub) or self.default_hub
+        url = hub.api_url("devices/" + dev_id + "/" + state)  # This URL is as specified in Hubitat maker app
+        if value is not None:
+            url = url + "/" + str(value)
         self.log.debug("URL for switching device " + url)
-        self.access_hubitat(url)
+        return self.access_hubitat(url, quiet=quiet, hub=hub) or None
+
+    def hub_get_attribute_all(self, attr):
+        # The current value of one attribute on every device that has it, as (device, value) pairs.  The
+        # catalog knows which devices have it and the attribute store usually has the values.  If any are
+        # missing or stale, one /devices/all from each hub they are on brings all of them up to date,
+        # rather than a /devices/<id> per device.  Whatever that fetch stored is the answer, even with an
+        # attribute_cache_ttl so short that the store already calls it stale.
+        asked = time.monotonic()
+        self.wait_for_catalog()
+        readings, missing = self.read_attribute_store(self.catalog.reporting(attr), attr)
+        self.metrics.hit('attr_store.bulk', not missing)
+        if missing:
+            self.update_devices(quiet=True, hubs={device.hub for device in missing})
+            readings, missing = self.read_attribute_store(self.catalog.reporting(attr), attr, since=asked)
+            for device in missing:
+                self.log.debug(f"No {attr} from {device.label}")
+        return readings
 
-    def hub_get_attribute(self, dev_id, attr):
+    def read_attribute_store(self, devices, attr, since=None):
+        # Split devices into (device, value) readings we have and devices we do not
+        readings = []
+        missing = []
+        for device in devices:
+            found, value = self.attr_store.get(device.id, attr, device.hub, since)
+            if found:
+                readings.append((device, value))
+            else:
+                missing.append(device)
+        return readings, missing
+
+    def hub_get_attribute(self, dev_id, attr, hub=None):
         self.log.debug("Looking for attr {}".format(attr))
         # The json string from Hubitat turns into a dict.  The key attributes
         # has a value of a list.  The list is a list of dicts with the attribute
@@ -298,11 +945,22 @@ class HubitatIntegration(MycroftSkill):
             jsn = {"attributes": tempList}
             x = jsn["attributes"]
         else:
+            # Events pushed by the hub (or a recent fetch) usually mean we already know the answer
+            found, value = self.attr_store.get(dev_id, attr, hub)
+            self.metrics.hit('attr_store', found)
+            if found:
+                self.log.debug("Found cached attribute: " + str(value))
+                return value
             # Here we get the real json string from hubitat
-            url = "/apps/api/" + self.maker_api_app_id + "/devices/" + dev_id
-            retVal = self.access_hubitat(url)
-            jsn = json.loads(retVal)
+            hub_obj = self.hubs.get(hub) or self.default_hub
+            retVal = self.access_hubitat(hub_obj.api_url("devices/" + dev_id), hub=hub_obj)
+            try:
+                jsn = json.loads(retVal)
+            except ValueError:
+                self.log.debug("Bad returns from get device " + dev_id)
+                return None
             self.log.debug(jsn)
+            self.attr_store.update_device(dev_id, jsn.get("attributes", []), hub)
         # Now we have a nested set of dicts and lists as described above, either a simple
         # one for test or the real (and more complex) one for a real Hubitat
 
@@ -314,71 +972,144 @@ class HubitatIntegration(MycroftSkill):
                         return ret_attr.get('currentValue')
         return ""
     
-    def update_devices(self):
-        json_data = None
-        this_label = None
-        this_id = None
-        # Init the device list and command list with tests
-        self.dev_commands_dict = {"testOnDev": ["on"], "testOnOffDev": ["on", "off"],
-                                  "testLevelDev": ["on", "off", "setLevel"]}
-        self.dev_id_dict = {"testOnDev": "**testOnOff", "testOnOffDev": "**testOnOff", "testLevelDev": "**testLevel",
-                            "testAttrDev": "**testAttr"}
-        self.log.debug(self.access_token)
-
-        # Now get the actual devices from Hubitat and parse out the devices and their IDs and valid
-        # commands
-        request = self.access_hubitat("/apps/api/" + self.maker_api_app_id + "/devices/all")
-
-        if not request or request.find('AppException') != -1 or request.find('invalid_token') != -1:
-            self.speak_dialog('url.error')
-            self.log.debug("Bad returns from get all devices")
-            return 0
-        try:
-            json_data = json.loads(request)
-        except:
-            self.log.debug("Error on json load")
-        count = 0
-        for device in json_data:
-            # For every device returned, record as a dict the id to use in a URL and the label to be spoken
-            # thisId = device.items()['id']
-            # thisLabel = device.items()['label']
-            # self.log.info("Id is "+str(thisId)+"label is "+thisLabel)
-            for k, v in device.items():
-                self.log.debug("attribute is " + str(k) + " value is " + str(v))
-                if k == 'id':
-                    this_id = v
-                elif k == 'label':
-                    this_label = v
-                    self.dev_commands_dict[this_label] = []
-                elif k == 'commands':
-                    self.log.debug("Commands for " + this_label + " is=>" + str(v))
-                    for cmd in v:
-                        self.dev_commands_dict[this_label].append(cmd['command'])
-            self.dev_id_dict[this_label] = this_id
-            self.log.debug(self.dev_commands_dict[this_label])
-            count = count + 1
-        self.name_dict_present = True
+    @timed('catalog.refresh')
+    def update_devices(self, quiet=False, hubs=None):
+        # Bring the catalog up to date and return how many devices there are.  Anyone asking while the
+        # same refresh is already running gets its result (and last_diff) rather than downloading every
+        # device again.
+        key = ('refresh', frozenset(self.hubs if hubs is None else hubs))
+        count, shared = self.inflight.do(key, self.refresh_devices, quiet, hubs)
+        if shared:
+            self.metrics.count('catalog.refresh.shared')
+            if not count and self.last_diff is None and not quiet:
+                # Whoever started the refresh may not have said that the hub did not answer
+                self.speak_dialog('url.error')
         return count
 
-    def access_hubitat(self, part_url):
-        # This routine knows how to talk to the hubitat.  It builds the URL from
-        # the know access type (http://) and the domain info or dotted quad in
-        # self.address, followed by the command info passed in by the caller.
-        request = None
-        url = "http://" + self.address + part_url
-        try:
-            request = requests.get(url, params=self.access_token, timeout=5)
-        except:
-            # If the request throws an error, the address may have changed.  Try
-            # 'hubitat.local' as a backup.
+    def refresh_devices(self, quiet=False, hubs=None):
+        # Fetch the device lists from all the hubs (or just the named ones) at once, work out what changed
+        # on each since the last time and swap in a new catalog with just those changes applied.  A hub
+        # that is not asked or does not answer keeps its devices from last time.  The attribute values
+        # come along for free, so they go into the attribute store.  Only one refresh runs at a time.
+        self.load_snapshot()
+        with self.refresh_lock:
+            fetched = self.fan_out(self.fetch_devices, quiet, hubs=hubs)
+            if all(devices is None for devices in fetched.values()):
+                self.metrics.count('catalog.refresh.failed')
+                self.last_diff = None
+                # Nobody should wait for a catalog that is not coming; the next refresh tries again
+                self.catalog_ready.set()
+                return 0
+            shards = {}
+            diffs = []
+            for name in self.hubs:
+                shard = self.shards.get(name) or DeviceCatalog(min_score=self.min_fuzz or 0)
+                devices = fetched.get(name)
+                if devices is not None:
+                    diff = shard.diff(devices)
+                    if any(diff):
+                        shard = shard.apply(diff, devices)
+                    diffs.append(diff)
+                    for device in devices:
+                        self.attr_store.update_device(device.id, device.attributes, name)
+                elif name in fetched:
+                    self.metrics.count('catalog.refresh.failed')
+                shards[name] = shard
+            diff = CatalogDiff(*([item for d in diffs for item in getattr(d, field)] for field in CatalogDiff._fields))
+            if any(diff) or shards.keys() != self.shards.keys():
+                self.shards = shards
+                self.catalog = DeviceCatalog.merge(list(shards.values()), self.min_fuzz or 0)
+                self.save_snapshot()
+            self.last_diff = diff
+            self.catalog_ready.set()
+            return sum(len(shard.by_id) for shard in shards.values())
+
+    def fetch_devices(self, hub, quiet=False):
+        # Get the actual devices from one Hubitat and parse out the devices with their IDs, valid commands,
+        # capabilities and attributes.  Returns a list of Devices or None if the hub gave us nothing useful.
+        # The answer is parsed as it streams in, one device at a time, so even a hub with thousands of
+        # devices never has the whole document in memory.
+        request = self.hub_request(hub.api_url("devices/all"), quiet=quiet, stream=True, hub=hub)
+        if request is None:
+            return None
+        with request:
             try:
-                self.speak_dialog('url.backup')
-                self.address = socket.gethostbyname("hubitat.local")
-                url = "http://" + self.address + part_url
-                self.log.debug("Fell back to hubitat.local which translated to " + self.address)
-                request = requests.get(url, params=self.access_token, timeout=10)
-            except:
-                self.log.debug("Got an error from requests")
+                if not request.ok:
+                    raise ValueError(f"status {request.status_code}")
+                # For every device returned, record the id to use in a URL and the label to be spoken
+                with self.metrics.timer('catalog.parse'):
+                    return list(stream_devices(request.iter_content(chunk_size=65536), hub.name))
+            except Exception as e:
+                # Bad tokens and app exceptions come back as something other than a list of devices
+                if not quiet:
+                    self.speak_dialog('url.error')
+                self.log.debug(f"Bad returns from get all devices on {hub.name}: {e}")
+                return None
+
+    def access_hubitat(self, part_url, timeout=None, quiet=False, hub=None):
+        # This routine knows how to talk to the hubitat.  Returns the text of the hub's answer, or ""
+        # if there was no (good) answer.  Reads that are already on their way to the hub for someone else
+        # wait for that answer instead of asking again.  Commands are always sent; the command queue
+        # already keeps them from overlapping.
+        hub = hub or self.default_hub
+        if endpoint_name(part_url).endswith('<command>'):
+            return self.read_hubitat(part_url, timeout, quiet, hub)
+        text, shared = self.inflight.do((hub.name, part_url), self.read_hubitat, part_url, timeout, quiet, hub)
+        if shared:
+            self.metrics.count('hub.shared')
+            if not text and not quiet:
+                # Whoever made the request may not have said anything
                 self.speak_dialog('url.error')
+        return text
+
+    def read_hubitat(self, part_url, timeout=None, quiet=False, hub=None):
+        request = self.hub_request(part_url, timeout, quiet, hub=hub)
         return request.text if request else ""
 
+    def hub_request(self, part_url, timeout=None, quiet=False, stream=False, hub=None):
+        # Builds the URL from the known access type (http://) and the domain info or dotted quad of the
+        # hub (the default hub if none is given), followed by the command info passed in by the caller,
+        # and returns the response, or None if the hub could not be reached.  The request goes out on
+        # the hub's pooled session so the connection is reused.  While the hub is not answering its
+        # circuit breaker fails every call at once.
+        hub = hub or self.default_hub
+        if not hub.breaker.allow():
+            self.metrics.count('hub.breaker_open')
+            if not quiet:
+                self.speak_dialog('hub.unreachable')
+            return None
+        request = None
+        endpoint = 'hub.' + endpoint_name(part_url) if self.metrics.enabled else None
+        with self.metrics.timer(endpoint):
+            try:
+                if hub.address is None:
+                    raise ConnectionError(f"No address for hub {hub.name}")
+                url = "http://" + hub.address + part_url
+                request = hub.session.get(url, params=hub.params, timeout=timeout or self.request_timeout,
+                                          stream=stream)
+            except:
+                # If the request throws an error, the address may have changed.  Try
+                # 'hubitat.local' as a backup, if the health probe has found it somewhere else.
+                self.metrics.count('hub.fallback')
+                backup = self.address_cache.peek(hub.fallback_host) if hub.fallback_host else None
+                try:
+                    if backup is None or backup + hub.port == hub.address:
+                        raise ConnectionError("No other address for the hub")
+                    if not quiet:
+                        self.speak_dialog('url.backup')
+                    url = "http://" + backup + hub.port + part_url
+                    self.log.debug(f"Fell back to {hub.fallback_host} which translated to {backup}")
+                    request = hub.session.get(url, params=hub.params, timeout=self.backup_request_timeout,
+                                              stream=stream)
+                    hub.address = backup + hub.port
+                except:
+                    self.metrics.count('hub.failure')
+                    hub.breaker.failure()
+                    self.log.debug(f"Got an error from requests for hub {hub.name}")
+                    if not quiet:
+                        self.speak_dialog('url.error')
+                    return None
+        hub.breaker.success()
+        if endpoint and not request:
+            self.metrics.count(f"{endpoint}.status_{request.status_code}")
+        return request
@@ -1,4 +1,10 @@
-from .HubitatIntegration import HubitatIntegration
+import time
+
+_started = time.perf_counter()
+from .HubitatIntegration import HubitatIntegration  # noqa: E402
+
+# Reported with the initialize and warm-up times once the skill is up
+HubitatIntegration.import_seconds = time.perf_counter() - _started
 
 
 def create_skill():
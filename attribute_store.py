@@ -0,0 +1,51 @@
+import time
+from threading import Lock
+
+
+class AttributeStore:
+    # In-memory copy of device attribute values, keyed by hub, device id and attribute name.
+    # Values pushed by the hub (Maker API "URL to send device events to") are kept current by the
+    # hub itself, so they stay valid while the event listener is running, for up to `push_ttl` seconds
+    # in case an event went missing.  Values we pulled with /devices/<id> are only trusted for `ttl`.
+    def __init__(self, ttl=30, push_ttl=3600):
+        self.ttl = ttl
+        self.push_ttl = push_ttl
+        self.push_active = False
+        self._values = {}
+        self._lock = Lock()
+
+    def get(self, dev_id, attr, hub=None, since=None):
+        # Returns (True, value) on a usable cached value, otherwise (False, None).  A value stored at or
+        # after `since` (a time.monotonic() reading) is used however old `ttl` says it is.
+        with self._lock:
+            record = self._values.get((hub, str(dev_id)), {}).get(attr)
+        if record is None:
+            return False, None
+        value, stamp, pushed = record
+        age = time.monotonic() - stamp
+        if (pushed and self.push_active and age < self.push_ttl) or age < self.ttl or \
+                (since is not None and stamp >= since):
+            return True, value
+        return False, None
+
+    def push(self, dev_id, attr, value, hub=None):
+        # Called for every event the hub posts to us
+        with self._lock:
+            self._values.setdefault((hub, str(dev_id)), {})[attr] = (value, time.monotonic(), True)
+
+    def update_device(self, dev_id, attributes, hub=None):
+        # Record every attribute of a device we just fetched from the hub.  `attributes` is either the
+        # list of {'name': ..., 'currentValue': ...} dicts that /devices/<id> returns or the name -> value
+        # dict of a /devices/all entry.
+        if isinstance(attributes, dict):
+            values = attributes.items()
+        else:
+            values = [(attr.get('name'), attr.get('currentValue')) for attr in attributes]
+        now = time.monotonic()
+        with self._lock:
+            device = self._values.setdefault((hub, str(dev_id)), {})
+            for name, value in values:
+                if name is not None:
+                    pushed = name in device and device[name][2]
+                    device[name] = (value, now, pushed)
+
@@ -0,0 +1,292 @@
+import codecs
+import json
+from collections import namedtuple
+
+from .fuzzy_index import FuzzyIndex, normalize
+
+CatalogDiff = namedtuple('CatalogDiff', ['added', 'removed', 'renamed', 'changed'])
+
+# Bump this whenever the snapshot layout changes so old snapshots are ignored rather than misread
+SNAPSHOT_VERSION = 4
+
+# Devices using the same driver have the same commands and capabilities, so they share one frozenset
+_SHARED_SETS = {}
+
+# Words that say nothing about which devices are meant in "turn off all the things"
+GROUP_FILLER = {'the', 'all', 'every', 'my', 'of', 'device', 'devices', 'thing', 'things', 'everything'}
+
+
+class Device:
+    # One Hubitat device as the Maker API describes it.  There can be thousands of these on a big hub,
+    # hence the slots.  Commands and capabilities are frozensets so checking them is constant time.
+    # Ids are only unique on one hub, so a device is known by its key: the hub's name and the id.
+    __slots__ = ('id', 'label', 'normalized', 'commands', 'capabilities', 'attributes', 'room', 'hub')
+
+    def __init__(self, dev_id, label, commands=(), capabilities=(), attributes=None, normalized=None, room=None,
+                 hub=None):
+        self.id = dev_id
+        self.label = label
+        self.room = room
+        self.hub = hub
+        self.normalized = normalized or normalize(label)
+        self.commands = shared_set(commands)
+        self.capabilities = shared_set(capabilities)
+        # Attribute values as they were when the catalog was fetched.  Fine for things that rarely change
+        # like supportedThermostatModes; current values come from the attribute store.
+        self.attributes = attributes or {}
+
+    def __repr__(self):
+        return f"Device({self.id!r}, {self.label!r})"
+
+    @property
+    def is_test(self):
+        return str(self.id).startswith('**test')
+
+    @property
+    def key(self):
+        return self.hub, self.id
+
+    @classmethod
+    def from_maker_api(cls, data, hub=None):
+        # Build a device from one entry of /devices/all.  Capabilities mix names with dicts describing
+        # their attributes, and attributes may come as a name -> value dict or a list of dicts.
+        capabilities = [c for c in data.get('capabilities', []) if isinstance(c, str)]
+        attributes = data.get('attributes') or {}
+        if isinstance(attributes, list):
+            attributes = {a.get('name'): a.get('currentValue') for a in attributes if isinstance(a, dict)}
+        commands = [c['command'] if isinstance(c, dict) else c for c in data.get('commands', [])]
+        return cls(data.get('id'), data.get('label'), commands, capabilities, attributes, room=data.get('room'),
+                   hub=hub)
+
+    def to_list(self):
+        return [self.id, self.label, self.normalized, sorted(self.commands), sorted(self.capabilities),
+                self.attributes, self.room, self.hub]
+
+    @classmethod
+    def from_list(cls, item):
+        dev_id, label, normalized, commands, capabilities, attributes, room, hub = item
+        return cls(dev_id, label, commands, capabilities, attributes, normalized, room, hub)
+
+    def kind_words(self):
+        # The words that can describe what this device is: "lights" matches "Kitchen Light" and
+        # "switches" matches anything with the Switch capability
+        return set(self.normalized.split()) | {c.lower() for c in self.capabilities}
+
+
+def shared_set(items):
+    items = frozenset(items)
+    return _SHARED_SETS.setdefault(items, items)
+
+
+def singular(word):
+    if word.endswith(('ches', 'shes', 'sses', 'xes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def parse_groups(setting):
+    # Device groups come from settings either as a dict of group -> list of labels, or as text in the
+    # same relaxed style as the attribute settings: "downstairs: kitchen light, hall light; upstairs: ..."
+    if not setting:
+        return {}
+    if isinstance(setting, dict):
+        return {name: [m for m in members] for name, members in setting.items()}
+    groups = {}
+    for part in setting.replace('"', '').replace("'", "").split(';'):
+        name, _, members = part.partition(':')
+        if name.strip() and members.strip():
+            groups[name.strip()] = [m.strip() for m in members.split(',') if m.strip()]
+    return groups
+
+
+def iter_json_array(chunks):
+    # Yield the elements of a JSON array one at a time as its bytes arrive, so a huge /devices/all never
+    # has to be in memory as a whole: only the current chunk and the element being decoded are.
+    # Raises ValueError if the document is not an array or ends early.
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    started = False
+    for chunk in chunks:
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Most likely the element continues in the next chunk
+                break
+            if isinstance(item, (int, float)) and not isinstance(item, bool) and \
+                    buf[end:end + 1] in ('', '.', 'e', 'E'):
+                # A number that runs to the end of the chunk (digits, fraction or exponent) may go on in
+                # the next one
+                break
+            pos = end
+            yield item
+    raise ValueError("JSON array ended early")
+
+
+def stream_devices(chunks, hub=None):
+    # Devices from a streamed /devices/all, keeping only the fields the skill uses
+    for item in iter_json_array(chunks):
+        if isinstance(item, dict) and item.get('label') is not None:
+            yield Device.from_maker_api(item, hub)
+
+
+# These are always in the catalog so the regression tests work without a hub.  Their names come already
+# normalized so that building them does not load fuzzywuzzy while the skill is being imported.
+TEST_DEVICES = (Device("**testOnOff", "testOnDev", ["on"], normalized="testondev"),
+                Device("**testOnOff", "testOnOffDev", ["on", "off"], normalized="testonoffdev"),
+                Device("**testLevel", "testLevelDev", ["on", "off", "setLevel"], normalized="testleveldev"),
+                Device("**testAttr", "testAttrDev", normalized="testattrdev"))
+
+
+class DeviceCatalog:
+    # Everything we know about the hubs' devices, indexed by label and by key, plus the fuzzy index
+    # over the labels.  A catalog is never modified once it is in use.  Refreshing builds a new one
+    # from the old and the skill swaps it in with a single assignment, so intents always see either
+    # the old or the new catalog and never one that is half updated.
+    def __init__(self, devices=None, min_score=0, index=None):
+        devices = TEST_DEVICES if devices is None else devices
+        self.by_label = {d.label: d for d in devices}
+        # The test devices share ids, so only real devices are indexed by key
+        self.by_id = {d.key: d for d in devices if not d.is_test}
+        self.index = index if index is not None else \
+            FuzzyIndex.from_keys({d.label: d.normalized for d in self.by_label.values()}, min_score)
+        self._room_index = None
+        self._attr_index = None
+
+    def __len__(self):
+        return len(self.by_label)
+
+    def __iter__(self):
+        return iter(self.by_label.values())
+
+    def get(self, label):
+        # Exact label lookup; the labels fuzzy matching returns always hit this
+        return self.by_label.get(label)
+
+    def find(self, text):
+        # The old lookup, kept as a fallback for text that is not exactly a label: the first device
+        # whose label appears somewhere in the text
+        device = self.by_label.get(text)
+        if device is not None:
+            return device
+        for label, device in self.by_label.items():
+            if text.find(label) >= 0:
+                return device
+        return None
+
+    def rooms(self):
+        # Fuzzy index over the Hubitat room names, built the first time someone asks for a room
+        if self._room_index is None:
+            self._room_index = FuzzyIndex({d.room for d in self.by_label.values() if d.room}, self.index.min_score)
+        return self._room_index
+
+    def reporting(self, attr):
+        # The devices that have an attribute, for questions about every device at once.  The index over
+        # all the attribute names is built the first time someone asks, like the room index.
+        if self._attr_index is None:
+            index = {}
+            for device in self.by_id.values():
+                for name in device.attributes:
+                    index.setdefault(name, []).append(device)
+            self._attr_index = index
+        return self._attr_index.get(attr, [])
+
+    def select(self, kind=None, room=None, devices=None):
+        # The devices meant by "all the <kind> in the <room>".  Either part may be missing, and a kind like
+        # "everything" means every device.  Rooms are the ones assigned in Hubitat; if no Hubitat room
+        # matches, devices whose label contains the room name ("upstairs hall light") are used instead.
+        # `devices` narrows down a group of devices rather than the whole catalog.
+        devices = [d for d in (self.by_label.values() if devices is None else devices) if not d.is_test]
+        if room:
+            room_name, _ = self.rooms().match(room)
+            if room_name is not None:
+                devices = [d for d in devices if d.room == room_name]
+            else:
+                words = set(normalize(room).split()) - GROUP_FILLER
+                devices = [d for d in devices if words and words <= set(d.normalized.split())]
+        words = {singular(w) for w in normalize(kind or '').split()} - GROUP_FILLER
+        if words:
+            devices = [d for d in devices if words <= {singular(w) for w in d.kind_words()}]
+        return devices
+
+    def diff(self, devices):
+        # Compare a fresh device list from the hub against this catalog.  Devices are matched on their
+        # key, so a device whose label changed is a rename rather than a remove and an add.
+        fresh = {d.key: d for d in devices}
+        added = [fresh[i].label for i in fresh.keys() - self.by_id.keys()]
+        removed = [self.by_id[i].label for i in self.by_id.keys() - fresh.keys()]
+        renamed = []
+        changed = []
+        for i in fresh.keys() & self.by_id.keys():
+            old, new = self.by_id[i], fresh[i]
+            if old.label != new.label:
+                renamed.append((old.label, new.label))
+            elif old.commands != new.commands or old.capabilities != new.capabilities or \
+                    old.attributes.keys() != new.attributes.keys() or old.room != new.room:
+                changed.append(new.label)
+        return CatalogDiff(added, removed, renamed, changed)
+
+    def apply(self, diff, devices):
+        # Build the next catalog by applying only the differences.  Devices that did not change are
+        # carried over as they are, along with their fuzzy keys.
+        fresh = {d.label: d for d in devices}
+        gone = set(diff.removed) | {old for old, _ in diff.renamed}
+        new = set(diff.added) | {label for _, label in diff.renamed}
+        replaced = gone | set(diff.changed)
+        kept = [d for label, d in self.by_label.items() if label not in replaced]
+        index = self.index.updated(added=new, removed=gone)
+        return DeviceCatalog(kept + [fresh[label] for label in new | set(diff.changed)], index=index)
+
+    @classmethod
+    def merge(cls, catalogs, min_score=0):
+        # One catalog over the devices of several hubs, which is what names are resolved against.  If two
+        # hubs have a device with the same label (one shared with Hub Mesh, say) the label goes to the
+        # device on the hub listed first; both are still known by key.  One hub needs no merging.
+        if len(catalogs) == 1:
+            return catalogs[0]
+        devices = list(TEST_DEVICES)
+        for catalog in reversed(catalogs):
+            devices.extend(d for d in catalog.by_id.values())
+        return cls(devices, min_score)
+
+    def split(self):
+        # The opposite of merge: a catalog per hub name
+        hubs = {}
+        for device in self.by_id.values():
+            hubs.setdefault(device.hub, []).append(device)
+        if len(hubs) == 1:
+            return {hub: self for hub in hubs}
+        return {hub: DeviceCatalog(list(TEST_DEVICES) + devices, self.index.min_score)
+                for hub, devices in hubs.items()}
+
+    def to_snapshot(self, hub):
+        # A compact, JSON friendly copy of the catalog including the normalized labels, so loading it
+        # back needs no hub round-trip and no index building.  Test devices are added back on load.
+        devices = [d.to_list() for d in self.by_id.values()]
+        return {'version': SNAPSHOT_VERSION, 'hub': hub, 'devices': devices}
+
+    @classmethod
+    def from_snapshot(cls, snapshot, hub, min_score=0):
+        # Returns None if the snapshot is from an older layout or a different hub
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('hub') != hub:
+            return None
+        return cls(list(TEST_DEVICES) + [Device.from_list(item) for item in snapshot.get('devices', [])],
+                   min_score)
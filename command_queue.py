@@ -0,0 +1,122 @@
+import heapq
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+# Commands that undo whatever the one before them on the same device did, by what they change.  Within
+# the window only the last of these is sent.  Anything else (push, refresh...) is always sent.
+SUPERSEDES = {'on': 'switch', 'off': 'switch', 'setLevel': 'level', 'setThermostatMode': 'thermostatMode'}
+
+
+class CommandQueue:
+    # Outbound commands, queued per device.  A command waits up to `window` seconds before it is sent, and a
+    # later command that changes the same thing (set to 30, then to 40) replaces it, so a quick "brighter,
+    # a bit more, set it to 40" costs the hub one request.  A device's commands go out in order, one at a
+    # time; different devices are sent in parallel on `executor`.  submit() hands back a Future with
+    # whatever `send` returned for the command that was finally sent in its place.
+    def __init__(self, send, executor, window=0.1, metrics=None):
+        self.window = window
+        self._send = send
+        self._executor = executor
+        self._metrics = metrics
+        # Device key -> OrderedDict of what a command changes -> [command, value, futures]
+        self._pending = {}
+        # Devices with commands on the way to the hub; anything queued meanwhile waits for them
+        self._busy = set()
+        # Heap of (when, sequence, device key) for devices waiting out their window
+        self._due = []
+        self._scheduled = set()
+        self._sequence = 0
+        self._cond = Condition()
+        self._closed = False
+        self._thread = Thread(target=self._run, name='hubitat-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, key, command, value=None, wait=None):
+        # `wait` overrides the window for this command, e.g. 0 for one that someone is waiting on
+        future = Future()
+        slot = SUPERSEDES.get(command) or object()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The command queue is closed")
+            pending = self._pending.setdefault(key, OrderedDict())
+            entry = pending.pop(slot, None)
+            futures = entry[2] if entry else []
+            futures.append(future)
+            # A replacement goes to the back, so the device ends up in the state asked for last
+            pending[slot] = [command, value, futures]
+            if entry and self._metrics is not None:
+                self._metrics.count('queue.coalesced')
+            if key not in self._busy and key not in self._scheduled:
+                self._schedule(key, time.monotonic() + (self.window if wait is None else wait))
+        return future
+
+    def drain(self, timeout=None):
+        # Wait until everything queued so far has been sent.  Returns False on a timeout.
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def close(self):
+        # Send whatever is still waiting right away and stop the timer thread.  The executor is left to
+        # the caller, who should shut it down without waiting so the last commands still go out.
+        with self._cond:
+            self._closed = True
+            for _, _, key in self._due:
+                self._start(key)
+            self._due = []
+            self._scheduled.clear()
+            self._cond.notify_all()
+
+    def _schedule(self, key, when):
+        self._sequence += 1
+        heapq.heappush(self._due, (when, self._sequence, key))
+        self._scheduled.add(key)
+        self._cond.notify_all()
+
+    def _start(self, key):
+        self._busy.add(key)
+        try:
+            self._executor.submit(self._flush, key)
+        except RuntimeError:
+            # The executor is already shut down, so these will never be sent
+            self._busy.discard(key)
+            for _, _, futures in self._pending.pop(key, {}).values():
+                for future in futures:
+                    future.cancel()
+
+    def _run(self):
+        with self._cond:
+            while not self._closed:
+                if not self._due:
+                    self._cond.wait()
+                    continue
+                wait = self._due[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, key = heapq.heappop(self._due)
+                self._scheduled.discard(key)
+                self._start(key)
+
+    def _flush(self, key):
+        with self._cond:
+            batch = self._pending.pop(key, {})
+        for command, value, futures in batch.values():
+            try:
+                result = self._send(key, command, value)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future in futures:
+                    future.set_result(result)
+        with self._cond:
+            self._busy.discard(key)
+            if key in self._pending:
+                # More came in while we were sending; they have waited long enough already
+                if self._closed:
+                    self._start(key)
+                else:
+                    self._schedule(key, time.monotonic())
+            self._cond.notify_all()
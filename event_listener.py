@@ -0,0 +1,67 @@
+# Kept out of attribute_store so that http.server is only loaded when the event listener is turned on
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class _EventHandler(BaseHTTPRequestHandler):
+    # The Maker API posts each device event as {"content": {"name": ..., "value": ..., "deviceId": ...}}.
+    # With several hubs each one posts to its own path, /<hub name>; anything else is the default hub.
+    # The events are not authenticated, so only those sent from that hub's own address are taken.
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        hub = self.path.split('?')[0].strip('/') or self.server.default_hub
+        if self.server.hub_hosts().get(hub) != self.client_address[0]:
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            content = json.loads(self.rfile.read(length) or b'{}').get('content', {})
+        except (ValueError, AttributeError):
+            content = {}
+        if content.get('deviceId') is not None and content.get('name') is not None:
+            self.server.store.push(content['deviceId'], content['name'], content.get('value'), hub)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # One line on stderr per event would be far too chatty
+        pass
+
+
+class EventListener:
+    # A small HTTP server that the hub POSTs device events to.  It runs on a daemon thread and feeds
+    # the attribute store, so attribute questions can be answered without asking the hub.  `hub_hosts`
+    # returns the IP address of each hub by name, as it is now; events from anywhere else are refused.
+    def __init__(self, store, port, host='0.0.0.0', default_hub=None, hub_hosts=dict):
+        self.store = store
+        self._server = ThreadingHTTPServer((host, port), _EventHandler)
+        self._server.daemon_threads = True
+        self._server.store = store
+        self._server.hub_hosts = hub_hosts
+        self._server.default_hub = default_hub
+        self._thread = None
+
+    @property
+    def default_hub(self):
+        return self._server.default_hub
+
+    @default_hub.setter
+    def default_hub(self, hub):
+        self._server.default_hub = hub
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='hubitat-events', daemon=True)
+        self._thread.start()
+        self.store.push_active = True
+
+    def stop(self):
+        self.store.push_active = False
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,120 @@
+import difflib
+from collections import OrderedDict
+from threading import Lock
+
+# fuzzywuzzy is imported the first time a name is normalized or matched rather than when the skill loads
+fuzz = utils = None
+# Without python-Levenshtein fuzzywuzzy scores with difflib, and we can reuse one matcher per query
+_DIFFLIB_RATIO = True
+
+
+def load_fuzzywuzzy():
+    global fuzz, utils, _DIFFLIB_RATIO
+    if fuzz is None:
+        from fuzzywuzzy import fuzz as _fuzz, utils as _utils
+        _DIFFLIB_RATIO = _fuzz.SequenceMatcher is difflib.SequenceMatcher
+        utils = _utils
+        # Set last: other threads check fuzz to see whether everything is there
+        fuzz = _fuzz
+
+
+def normalize(text):
+    # This is the same normalization fuzz.token_sort_ratio does on every call: lower case, strip
+    # punctuation and sort the words.  Doing it once per name lets us score with the plain ratio.
+    if fuzz is None:
+        load_fuzzywuzzy()
+    return " ".join(sorted(utils.full_process(text, force_ascii=True).split()))
+
+
+class FuzzyIndex:
+    # Holds the normalized, token-sorted form of every name we might match an utterance against
+    # (Hubitat device labels or attribute names), plus a small LRU of utterances we have already
+    # resolved.  Scores are identical to running fuzz.token_sort_ratio against every name.
+    def __init__(self, names=(), min_score=0, cache_size=128):
+        self.min_score = min_score
+        self.cache_size = cache_size
+        self._keys = {}
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        for name in names:
+            self._keys[name] = normalize(name)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @classmethod
+    def from_keys(cls, keys, min_score=0, cache_size=128):
+        # Build an index from names that are already normalized (name -> key), e.g. from a snapshot
+        index = cls(min_score=min_score, cache_size=cache_size)
+        index._keys = dict(keys)
+        return index
+
+    def updated(self, added=(), removed=()):
+        # A new index sharing the normalized keys of every name that did not change.  The utterance
+        # cache starts empty because any cached answer could point at a removed name.
+        index = FuzzyIndex(min_score=self.min_score, cache_size=self.cache_size)
+        index._keys = dict(self._keys)
+        for name in removed:
+            index._keys.pop(name, None)
+        for name in added:
+            index._keys[name] = normalize(name)
+        return index
+
+    def set_min_score(self, min_score):
+        with self._lock:
+            self.min_score = min_score
+            self._cache.clear()
+
+    def match(self, text, metrics=None, name='fuzzy'):
+        # Return (name, score) for the best name scoring above min_score, or (None, score) if there is
+        # none.  The score of a miss is only good for logging: names that could not reach min_score are
+        # never scored, so it is at most min_score and often 0.
+        # Cache hits and misses are counted as `name` if a Metrics is passed in.
+        if not text:
+            return None, 0
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                result = self._cache[text]
+                if metrics is not None:
+                    metrics.hit(name, True)
+                return result
+        if metrics is not None:
+            metrics.hit(name, False)
+        result = self._score(normalize(text))
+        with self._lock:
+            self._cache[text] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _score(self, query):
+        # Returns exactly what fuzz.token_sort_ratio(name, text) would give for the best name, but
+        # cheap upper bounds on the ratio let us skip most names without computing the full match.
+        # A name only has to be scored if its bound can beat both min_score and the best so far.
+        if not query:
+            return None, 0
+        if fuzz is None:
+            load_fuzzywuzzy()
+        matcher = difflib.SequenceMatcher(None, "", query)
+        q_len = len(query)
+        best_name, best_score = None, 0
+        floor = self.min_score
+        for name, key in self._keys.items():
+            total = q_len + len(key)
+            # A ratio is 2*matches/total length, so it can never beat 2*shorter/total
+            if not total or utils.intr(200 * min(q_len, len(key)) / total) <= floor:
+                continue
+            matcher.set_seq1(key)
+            if utils.intr(100 * matcher.quick_ratio()) <= floor:
+                continue
+            if _DIFFLIB_RATIO:
+                score = utils.intr(100 * matcher.ratio())
+            else:
+                score = fuzz.ratio(key, query)
+            if score > best_score:
+                best_name, best_score = name, score
+                floor = max(floor, score)
+        if best_name is None or best_score <= self.min_score:
+            return None, best_score
+        return best_name, best_score
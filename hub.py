@@ -0,0 +1,103 @@
+import socket
+from threading import Lock
+
+from .hub_health import CircuitBreaker
+
+# The name the hub from the single hub settings goes by
+DEFAULT_HUB = 'hubitat'
+
+
+class Hub:
+    # One Hubitat hub and what it takes to talk to it: where it is, its Maker API app and token, and a
+    # pooled keep-alive session and circuit breaker of its own, so one hub that is slow or down never
+    # holds up commands to the others.
+    def __init__(self, name, address, app_id, access_token, pool_size=4, failure_threshold=3, reset_timeout=30,
+                 fallback_host=None):
+        self.name = name
+        # A port may follow the address (host:port) and is kept as it is
+        self.host, sep, port = str(address).partition(':')
+        self.port = sep + port
+        self.address = None
+        self.app_id = str(app_id)
+        self.params = {'access_token': access_token}
+        # Another name to try when the hub stops answering at its address, like hubitat.local
+        self.fallback_host = fallback_host
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.pool_size = max(1, int(pool_size))
+        self._session = None
+        self._session_lock = Lock()
+
+    def __repr__(self):
+        return f"Hub({self.name!r}, {self.host + self.port!r})"
+
+    @property
+    def identity(self):
+        # Where this hub's devices come from, as configured; a snapshot is only loaded for the same hubs
+        return f"{self.host}{self.port}/{self.app_id}"
+
+    def api_url(self, path):
+        # The part of a Maker API URL after the address, e.g. api_url("devices/all")
+        return "/apps/api/" + self.app_id + "/" + path
+
+    @property
+    def session(self):
+        # A single long-lived session keeps the TCP connection to the hub open between intents
+        # instead of paying for a new connection on every Maker API call.  It (and requests) is only
+        # loaded when first used, which the skill's warm-up does off the skill loader thread.
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session = requests.Session()
+                    session.headers.update({'Connection': 'keep-alive'})
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    def resolve(self, address_cache, refresh=False):
+        # Look up (or refresh) the hub's address.  Returns True if it changed.  Raises socket.error only
+        # if the host never resolved, in which case the host is used as given, so calls to the hub fail
+        # like calls to any hub that is down instead of finding no address at all.
+        try:
+            address = address_cache.resolve(self.host, refresh=refresh) + self.port
+        except socket.error:
+            if self.address is None:
+                self.address = self.host + self.port
+            raise
+        changed = address != self.address
+        self.address = address
+        return changed
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+def parse_hubs(settings):
+    # The hubs to talk to, as (name, address, app id, access token) tuples.  `hubs` is either a list of
+    # dicts with the same keys as the single hub settings plus an optional name, or text in the relaxed
+    # style of the other list settings: "upstairs: 192.168.1.20, 12, token; garage: 192.168.1.21, 7, token".
+    # Without it the single hub settings are used.  Hubs missing an address, app id or token are skipped.
+    setting = settings.get('hubs')
+    if not setting:
+        hubs = [{'name': DEFAULT_HUB, 'local_address': settings.get('local_address'),
+                 'hubitat_maker_api_app_id': settings.get('hubitat_maker_api_app_id'),
+                 'access_token': settings.get('access_token')}]
+    elif isinstance(setting, list):
+        hubs = setting
+    else:
+        hubs = []
+        for part in setting.replace('"', '').replace("'", "").split(';'):
+            name, _, fields = part.partition(':')
+            fields = [f.strip() for f in fields.split(',')]
+            if name.strip() and len(fields) == 3:
+                hubs.append({'name': name.strip(), 'local_address': fields[0],
+                             'hubitat_maker_api_app_id': fields[1], 'access_token': fields[2]})
+    parsed = []
+    for number, hub in enumerate(hubs, 1):
+        fields = (hub.get('local_address'), hub.get('hubitat_maker_api_app_id'), hub.get('access_token'))
+        if None not in fields and '' not in fields:
+            parsed.append((str(hub.get('name') or f"hub{number}"),) + fields)
+    return parsed
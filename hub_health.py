@@ -0,0 +1,85 @@
+import socket
+import time
+from threading import Lock
+
+
+class AddressCache:
+    # Remembers what hub host names resolve to for `ttl` seconds, so a slow .local lookup is paid for by the
+    # background health probe rather than by someone waiting for a light to come on.  If a lookup fails
+    # the last good address is kept.
+    def __init__(self, ttl=300, resolver=socket.gethostbyname):
+        self.ttl = ttl
+        self._resolver = resolver
+        self._addresses = {}
+        self._lock = Lock()
+
+    def peek(self, host):
+        # The cached address, however old, without ever touching DNS
+        with self._lock:
+            entry = self._addresses.get(host)
+        return entry[0] if entry else None
+
+    def resolve(self, host, refresh=False):
+        # Raises socket.error only if the host never resolved
+        with self._lock:
+            entry = self._addresses.get(host)
+        if entry and not refresh and time.monotonic() < entry[1]:
+            return entry[0]
+        try:
+            address = self._resolver(host)
+            socket.inet_aton(address)
+        except socket.error:
+            if entry:
+                return entry[0]
+            raise
+        with self._lock:
+            self._addresses[host] = (address, time.monotonic() + self.ttl)
+        return address
+
+
+class CircuitBreaker:
+    # Stops us sending requests to a hub that is not answering.  After `failure_threshold` failures in a
+    # row the breaker opens and every call fails at once.  After `reset_timeout` seconds (or as soon as
+    # the health probe reaches the hub) one request is let through to see whether the hub is back.
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = 0.0
+        self._trial = False
+        self._lock = Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial = False
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened = time.monotonic()
+                self._trial = False
+
+    @property
+    def is_closed(self):
+        return self.state == self.CLOSED
@@ -0,0 +1,145 @@
+import json
+import time
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+
+# Upper bounds of the latency histogram buckets, in milliseconds.  Anything slower lands in the last one.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the given percentile; good enough to see where time goes
+        wanted = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS + (None,), self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return bound if bound is not None else self.max
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'mean_ms': round(self.total / self.count, 3) if self.count else None,
+                'min_ms': self.min, 'max_ms': self.max, 'p50_ms': self.percentile(50),
+                'p95_ms': self.percentile(95), 'p99_ms': self.percentile(99),
+                'buckets_ms': dict(zip([str(b) for b in BUCKETS_MS] + ['inf'], self.counts))}
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.count(self.name + '.error')
+        return False
+
+
+class _NullTimer:
+    # What timer() hands out while metrics are off: entering and leaving it costs next to nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    # Counters and latency histograms for the skill's hot paths.  Everything is a no-op while disabled.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._counters = {}
+        self._histograms = {}
+        self._lock = Lock()
+        self._started = time.time()
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + amount
+
+    def hit(self, name, hit):
+        # Record a cache lookup; the snapshot turns these into a hit rate
+        if self.enabled:
+            self.count(name + ('.hit' if hit else '.miss'))
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            with self._lock:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram()
+                histogram.add(seconds * 1000)
+
+    def timer(self, name):
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {name: h.to_dict() for name, h in self._histograms.items()}
+        hit_rates = {}
+        for name in counters:
+            if name.endswith('.hit'):
+                cache = name[:-4]
+                hits, misses = counters[name], counters.get(cache + '.miss', 0)
+                hit_rates[cache] = round(hits / (hits + misses), 4)
+        for name in counters:
+            if name.endswith('.miss') and name[:-5] not in hit_rates:
+                hit_rates[name[:-5]] = 0.0
+        return {'enabled': self.enabled, 'since': self._started, 'counters': counters,
+                'latency': histograms, 'hit_rates': hit_rates}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+
+def timed(name):
+    # Decorator for skill methods: time every call as `name` when the skill's metrics are on
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return func(self, *args, **kwargs)
+            self.metrics.count(name + '.calls')
+            with self.metrics.timer(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,188 @@
+import re
+import time
+from threading import Event, Lock
+
+# The kinds of step a routine can have, written the way they would be spoken.  A step that starts with
+# "then" waits for the step before it; otherwise steps only wait for earlier steps on the same device.
+_STEP_PATTERNS = (
+    (re.compile(r'^(?:turn|switch) (on|off) (?:the )?(.+)$'), lambda m: (m[2], m[1], None)),
+    (re.compile(r'^(?:turn|switch) (?:the )?(.+) (on|off)$'), lambda m: (m[1], m[2], None)),
+    # "set"/"dim" to a number is a level, to a word a thermostat mode; which one is decided when compiling
+    (re.compile(r'^(?:set|dim|brighten) (?:the )?(.+?) to (\S+?)(?: ?%| percent)?$'), lambda m: (m[1], None, m[2])),
+)
+
+
+def parse_step(text):
+    # Turn "dim living room lamp to 20" into a step spec, or None if it makes no sense
+    text = " ".join(text.lower().split())
+    after_previous = text.startswith('then ')
+    if after_previous:
+        text = text[5:]
+    for pattern, fields in _STEP_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            device, command, value = fields(match)
+            return {'device': device, 'command': command, 'value': value,
+                    'after': ['previous'] if after_previous else []}
+    return None
+
+
+def parse_routines(setting):
+    # Routines come from settings either as a dict of name -> steps, where a step is text or a dict with
+    # device, command, value and after (the numbers of the steps it waits for, counting from 0), or as
+    # text in the relaxed style of the other settings:
+    # "movie time: dim living room lamp to 20, turn off kitchen light, then set thermostat to cool; ..."
+    if not setting:
+        return {}
+    if isinstance(setting, dict):
+        routines = setting
+    else:
+        routines = {}
+        for part in setting.replace('"', '').replace("'", "").split(';'):
+            name, _, steps = part.partition(':')
+            if name.strip() and steps.strip():
+                routines[name.strip()] = [s for s in steps.split(',') if s.strip()]
+    parsed = {}
+    for name, steps in routines.items():
+        specs = []
+        for step in steps:
+            spec = parse_step(step) if isinstance(step, str) else dict(step)
+            if spec is None:
+                spec = {'problem': f"cannot understand {step!r}"}
+            spec['text'] = step if isinstance(step, str) else f"{step.get('command')} {step.get('device')}"
+            specs.append(spec)
+        parsed[name] = specs
+    return parsed
+
+
+class Step:
+    __slots__ = ('index', 'text', 'device', 'command', 'value', 'after')
+
+    def __init__(self, index, text, device, command, value, after):
+        self.index = index
+        self.text = text
+        self.device = device
+        self.command = command
+        self.value = value
+        # Indexes of the steps that have to finish (and work) before this one starts
+        self.after = after
+
+    def __repr__(self):
+        return f"Step({self.index}, {self.command!r}, {self.device.label!r}, {self.value!r})"
+
+
+class StepResult:
+    __slots__ = ('step', 'ok', 'seconds', 'skipped')
+
+    def __init__(self, step, ok, seconds=0.0, skipped=False):
+        self.step = step
+        self.ok = ok
+        self.seconds = seconds
+        self.skipped = skipped
+
+
+class Routine:
+    # A routine compiled against one catalog: every device is already resolved to its hub and id and every
+    # command checked, so running it needs no name matching.  `problems` are the steps that could not be
+    # compiled; they are left out and reported as failures.
+    def __init__(self, name, steps, problems=()):
+        self.name = name
+        self.steps = steps
+        self.problems = list(problems)
+
+    @classmethod
+    def compile(cls, name, specs, catalog, supported_modes):
+        # `supported_modes(device)` lists the thermostat modes a device has, to tell "set to cool" (a mode)
+        # from "set to 40" (a level)
+        steps = []
+        problems = []
+        compiled = {}
+        last_on_device = {}
+        for number, spec in enumerate(specs):
+            problem = spec.get('problem')
+            label = catalog.index.match(spec['device'])[0] if not problem and spec.get('device') else None
+            device = catalog.get(label) if label is not None else None
+            command = spec.get('command')
+            value = spec.get('value')
+            if not problem and device is None:
+                problem = f"no device like {spec.get('device')!r}"
+            if not problem and command is None:
+                command = 'setThermostatMode' if value in supported_modes(device) else 'setLevel'
+            if not problem and command not in device.commands:
+                problem = f"{device.label} cannot {command}"
+            after = set()
+            for wanted in spec.get('after', []):
+                wanted = number - 1 if wanted == 'previous' else int(wanted)
+                if wanted not in compiled:
+                    problem = problem or f"it waits for step {wanted + 1}, which cannot run"
+                else:
+                    after.add(compiled[wanted])
+            if problem:
+                problems.append(f"{spec.get('text')}: {problem}")
+                continue
+            if device.key in last_on_device:
+                after.add(last_on_device[device.key])
+            step = Step(len(steps), spec.get('text'), device, command, value, tuple(sorted(after)))
+            compiled[number] = last_on_device[device.key] = step.index
+            steps.append(step)
+        return cls(name, steps, problems)
+
+    def run(self, submit, timeout=None):
+        # Send every step whose steps before it are done, all at once, and the rest as they become ready.
+        # `submit(step)` sends one and returns a Future whose result is None if it did not work.  A step
+        # that waits for one that failed is skipped.  Returns a StepResult per step, in order, or None
+        # for the steps that had not finished when `timeout` ran out.
+        results = [None] * len(self.steps)
+        waiting = {step.index: set(step.after) for step in self.steps}
+        dependents = {step.index: [] for step in self.steps}
+        for step in self.steps:
+            for index in step.after:
+                dependents[index].append(step.index)
+        lock = Lock()
+        finished = Event()
+        remaining = [len(self.steps)]
+
+        def record(step, result):
+            # With the lock held: note the result and return the steps it lets start.  Everything waiting
+            # on a step that did not work is skipped, and everything waiting on those, and so on.
+            results[step.index] = result
+            remaining[0] -= 1
+            ready = []
+            for index in dependents[step.index]:
+                waiting[index].discard(step.index)
+                if results[index] is not None:
+                    continue
+                if not result.ok:
+                    record(self.steps[index], StepResult(self.steps[index], False, skipped=True))
+                elif not waiting[index]:
+                    ready.append(self.steps[index])
+            return ready
+
+        def done(step, result):
+            with lock:
+                ready = record(step, result)
+                if remaining[0] == 0:
+                    finished.set()
+            for ready_step in ready:
+                start(ready_step)
+
+        def start(step):
+            started = time.perf_counter()
+
+            def answered(future):
+                ok = not future.cancelled() and future.exception() is None and future.result() is not None
+                done(step, StepResult(step, ok, time.perf_counter() - started))
+            try:
+                future = submit(step)
+            except Exception:
+                done(step, StepResult(step, False))
+            else:
+                future.add_done_callback(answered)
+
+        if not self.steps:
+            return results
+        for step in [s for s in self.steps if not s.after]:
+            start(step)
+        finished.wait(timeout)
+        with lock:
+            return list(results)
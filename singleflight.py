@@ -0,0 +1,47 @@
+from threading import Event, Lock
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Callers asking for the same key at the same time share one call: the first one makes it and the
+    # others wait for its result (or its exception) instead of sending the hub the same request again.
+    # Nothing is kept once the call is over, so the next caller after that makes a new one.
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        # Returns (result, shared), where shared is True if the result came from someone else's call
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def __len__(self):
+        # How many calls are in flight
+        with self._lock:
+            return len(self._calls)
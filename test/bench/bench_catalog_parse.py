@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Peak memory and time to turn a /devices/all answer into Devices: the old way (read the whole answer
+# into a string, json.loads it, then walk it) against the streaming parse update_devices uses now.
+#
+#   python test/bench/bench_catalog_parse.py --sizes 500 5000
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import mycroft_stub  # noqa: E402
+
+mycroft_stub.install()
+from hubitat_integration_skill.catalog import Device, stream_devices  # noqa: E402
+from fake_maker_api import FakeMakerApi, generate_devices  # noqa: E402
+
+# Real drivers often have long command lists; pad the generated ones out to something similar
+EXTRA_COMMANDS = [f"command{i}" for i in range(30)]
+
+
+def payload(size):
+    api = FakeMakerApi(generate_devices(size, seed=size))
+    api.stop()
+    devices = []
+    for device in api.devices.values():
+        device['commands'] = device['commands'] + EXTRA_COMMANDS
+        devices.append(api.full_device(device))
+    return json.dumps(devices).encode()
+
+
+def chunks(data, size=65536):
+    # What requests' iter_content hands us
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def whole(data):
+    text = b"".join(chunks(data)).decode()
+    return [Device.from_maker_api(d) for d in json.loads(text) if d.get('label') is not None]
+
+
+def streamed(data):
+    return list(stream_devices(chunks(data)))
+
+
+def measure(parse, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    devices = parse(data)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Time again without tracemalloc slowing every allocation down
+    start = time.perf_counter()
+    parse(data)
+    return len(devices), time.perf_counter() - start, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 5000])
+    args = parser.parse_args()
+    print(f"{'devices':>8} {'payload MB':>11} {'parser':>9} {'time ms':>9} {'peak MB':>9}")
+    for size in args.sizes:
+        data = payload(size)
+        for name, parse in (('whole', whole), ('streamed', streamed)):
+            count, elapsed, peak, _ = measure(parse, data)
+            assert count == size
+            print(f"{size:>8} {len(data) / 1e6:>11.2f} {name:>9} {elapsed * 1000:>9.1f} {peak / 1e6:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
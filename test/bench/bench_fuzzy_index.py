@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Compares resolving an utterance to a device label with a linear fuzz.token_sort_ratio scan (what
+# get_hub_device_name_from_text used to do) against the prebuilt FuzzyIndex, as the device count grows.
+#
+#   python test/bench/bench_fuzzy_index.py
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import mycroft_stub  # noqa: E402
+
+mycroft_stub.install()
+from fuzzywuzzy import fuzz  # noqa: E402
+from hubitat_integration_skill.fuzzy_index import FuzzyIndex  # noqa: E402
+
+ROOMS = ["kitchen", "living room", "bedroom", "garage", "office", "hall", "porch", "basement", "attic", "den"]
+THINGS = ["light", "lamp", "outlet", "fan", "switch", "dimmer", "heater", "thermostat", "sensor", "strip"]
+MIN_SCORE = 65
+
+
+def make_labels(count):
+    rnd = random.Random(count)
+    return [f"{rnd.choice(ROOMS)} {rnd.choice(THINGS)} {i}" for i in range(count)]
+
+
+def linear(labels, text):
+    best_name, best_score = None, MIN_SCORE
+    for label in labels:
+        score = fuzz.token_sort_ratio(label, text)
+        if score > best_score:
+            best_name, best_score = label, score
+    return best_name
+
+
+def timed(fn, utterances):
+    start = time.perf_counter()
+    for text in utterances:
+        fn(text)
+    return (time.perf_counter() - start) / len(utterances) * 1000
+
+
+def main():
+    print(f"{'devices':>8} {'linear ms':>10} {'index ms':>10} {'cached ms':>10} {'build ms':>9}")
+    for count in (10, 100, 500, 1000, 5000):
+        labels = make_labels(count)
+        utterances = [f"the {label}" for label in random.Random(0).sample(labels, min(20, count))]
+        start = time.perf_counter()
+        index = FuzzyIndex(labels, MIN_SCORE)
+        build = (time.perf_counter() - start) * 1000
+        lin = timed(lambda t: linear(labels, t), utterances)
+        idx = timed(index.match, utterances)
+        cached = timed(index.match, utterances)
+        print(f"{count:>8} {lin:>10.3f} {idx:>10.3f} {cached:>10.4f} {build:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# End-to-end latency of the skill's intent handlers against a local fake Maker API.
+#
+# For each catalog size a fake hub with that many devices is started, the skill is pointed at it and
+# every intent is driven through its handler with real HTTP requests.  Reports p50/p95/p99 latency and
+# the hub requests each intent cost.  Runs against the same Mycroft stand-in as the unit tests.
+#
+#   python test/bench/bench_intents.py --sizes 10 100 1000 5000 --latency 0.02 --jitter 0.01
+import argparse
+import random
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi, generate_devices  # noqa: E402
+from skill_harness import Message, make_skill  # noqa: E402
+
+
+def percentile(samples, pct):
+    # Nearest-rank percentile, in milliseconds
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank] * 1000
+
+
+def intents(skill, devices, rnd):
+    # (name, handler, message) for one round of every intent, on devices picked at random
+    lights = [d for d in devices if 'setLevel' in d['commands']] or devices
+    switches = [d for d in devices if 'on' in d['commands']] or devices
+    thermostats = [d for d in devices if 'setThermostatMode' in d['commands']] or devices
+    light, switch, thermostat = rnd.choice(lights), rnd.choice(switches), rnd.choice(thermostats)
+    return [
+        ('on', skill.handle_on_intent, {'device': 'the ' + switch['label']}),
+        ('off', skill.handle_off_intent, {'device': switch['label']}),
+        ('level', skill.handle_level_intent, {'device': light['label'], 'level': str(rnd.randint(1, 99))}),
+        ('mode', skill.handle_level_intent, {'device': thermostat['label'], 'level': rnd.choice(['heat', 'cool'])}),
+        ('attr', skill.handle_attr_intent, {'attr': 'temperature', 'device': thermostat['label']}),
+        ('attr_all', skill.handle_attr_all_intent, {'attr': 'temperature'}),
+        ('group', skill.handle_group_off_intent, {'group': 'lights', 'room': rnd.choice(devices)['room']}),
+        ('rescan', skill.handle_rescan_intent, {}),
+    ]
+
+
+def run(size, args):
+    devices = generate_devices(size, seed=size)
+    hub = FakeMakerApi(devices, latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                       seed=size).start()
+    skill = make_skill(hub, update=False, attribute_cache_ttl=args.attribute_cache_ttl)
+    try:
+        start = time.perf_counter()
+        skill.update_devices()
+        load = time.perf_counter() - start
+        rnd = random.Random(size)
+        timings = {}
+        requests = {}
+        errors = {}
+        for _ in range(args.iterations):
+            for name, handler, data in intents(skill, devices, rnd):
+                if name == 'rescan' and size > args.max_rescan_size:
+                    continue
+                hub.reset()
+                start = time.perf_counter()
+                try:
+                    handler(Message('', data))
+                except Exception:
+                    errors[name] = errors.get(name, 0) + 1
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+                # Commands are confirmed before they are sent, so wait for them before counting requests
+                skill.command_queue.drain()
+                requests.setdefault(name, []).append(hub.total_requests)
+    finally:
+        skill.shutdown()
+        hub.stop()
+    return load, timings, requests, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the fake hub takes per request')
+    parser.add_argument('--jitter', type=float, default=0.005, help='extra random seconds per request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--attribute-cache-ttl', type=float, default=30)
+    parser.add_argument('--max-rescan-size', type=int, default=5000, help='skip rescans above this many devices')
+    args = parser.parse_args()
+
+    print(f"latency={args.latency}s jitter={args.jitter}s failure rate={args.failure_rate} "
+          f"iterations={args.iterations}")
+    print(f"{'devices':>8} {'intent':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/intent':>11} {'errors':>7}")
+    for size in args.sizes:
+        load, timings, requests, errors = run(size, args)
+        print(f"{size:>8} {'load':>8} {load * 1000:>9.1f}")
+        for name, samples in timings.items():
+            print(f"{size:>8} {name:>8} {percentile(samples, 50):>9.2f} {percentile(samples, 95):>9.2f} "
+                  f"{percentile(samples, 99):>9.2f} {sum(requests[name]) / len(requests[name]):>11.2f} "
+                  f"{errors.get(name, 0):>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+# pytest loads this before any test module, so the skill is always imported against the Mycroft stand-in
+import mycroft_stub
+
+mycroft_stub.install()
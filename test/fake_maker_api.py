@@ -0,0 +1,200 @@
+import json
+import random
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import unquote, urlsplit
+from urllib.request import Request, urlopen
+
+ROOMS = ["Kitchen", "Living Room", "Bedroom", "Guest Room", "Garage", "Office", "Hall", "Porch", "Basement", "Den"]
+KINDS = [
+    ("light", ["on", "off", "setLevel", "refresh"], ["Switch", "SwitchLevel", "Light"], {"switch": "off", "level": "0"}),
+    ("lamp", ["on", "off", "setLevel"], ["Switch", "SwitchLevel"], {"switch": "off", "level": "0"}),
+    ("outlet", ["on", "off", "refresh"], ["Switch", "Outlet"], {"switch": "off", "power": "0"}),
+    ("fan", ["on", "off", "setSpeed"], ["Switch", "FanControl"], {"switch": "off", "speed": "off"}),
+    ("thermostat", ["setThermostatMode", "setHeatingSetpoint", "setCoolingSetpoint"], ["Thermostat"],
+     {"temperature": "68", "thermostatMode": "heat", "supportedThermostatModes": "[heat, cool, auto, off]"}),
+    ("sensor", ["refresh"], ["TemperatureMeasurement", "MotionSensor"], {"temperature": "70", "motion": "inactive"}),
+]
+
+
+def generate_devices(count, seed=0):
+    # A made-up but plausible hub: lights, lamps, outlets, fans, thermostats and sensors spread over rooms.
+    # Labels are unique, like Hubitat requires.
+    rnd = random.Random(seed)
+    devices = []
+    used = Counter()
+    for i in range(count):
+        room = rnd.choice(ROOMS)
+        kind, commands, capabilities, attributes = rnd.choice(KINDS)
+        label = f"{room} {kind}".lower()
+        used[label] += 1
+        if used[label] > 1:
+            label = f"{label} {used[label]}"
+        devices.append({'id': i + 1, 'label': label, 'commands': commands, 'capabilities': capabilities,
+                        'attributes': dict(attributes), 'room': room})
+    return devices
+
+
+class _MakerApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this every keep-alive answer waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        api = self.server.api
+        if not api.respond_normally():
+            api.record('failed')
+            return self._reply(500, {'error': 'AppException'})
+        path = urlsplit(self.path).path
+        parts = [unquote(p) for p in path.split('/') if p]
+        # /apps/api/<app id>/devices[/all | /<id>[/<command>[/<value>]]]
+        if parts[:2] != ['apps', 'api'] or len(parts) < 4 or parts[2] != api.app_id or parts[3] != 'devices':
+            return self._reply(404, {'error': 'not found'})
+        rest = parts[4:]
+        if rest == ['all']:
+            api.record('devices/all')
+            return self._reply(200, [api.full_device(d) for d in api.devices.values()])
+        if not rest:
+            api.record('devices')
+            return self._reply(200, [{'id': d['id'], 'label': d['label'], 'name': d['label'], 'type': 'Virtual'}
+                                     for d in api.devices.values()])
+        device = api.devices.get(rest[0])
+        if device is None:
+            api.record('devices/<id>')
+            return self._reply(404, {'error': 'no such device'})
+        if len(rest) == 1:
+            api.record('devices/<id>')
+            return self._reply(200, api.device_detail(device))
+        api.record('devices/<id>/<command>')
+        events = api.command(device, rest[1], rest[2] if len(rest) > 2 else None)
+        self._reply(200, api.device_detail(device))
+        api.post_events(device, events)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMakerApi:
+    # A stand-in for the Hubitat Maker API on localhost.  It serves the handful of endpoints the skill
+    # uses from an in-memory device list and counts every request it gets, by endpoint.  Each answer can be
+    # delayed by `latency` seconds plus up to `jitter`, and `failure_rate` of them fail with an
+    # AppException the way a busy hub does.  If `event_url` is set, command results are posted there
+    # like the Maker API's "URL to send device events to".
+    def __init__(self, devices=(), app_id='1', token='test-token', latency=0.0, jitter=0.0, failure_rate=0.0,
+                 seed=0, event_url=None):
+        self.app_id = str(app_id)
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.event_url = event_url
+        self._random = random.Random(seed)
+        self.devices = {}
+        self.requests = Counter()
+        self.commands = []
+        self._lock = Lock()
+        for device in devices:
+            self.add_device(**device)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _MakerApiHandler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def settings(self, **extra):
+        # Settings that point the skill at this hub
+        settings = {'access_token': self.token, 'local_address': self.address, 'minimum_fuzzy_score': 65,
+                    'hubitat_maker_api_app_id': self.app_id, 'attr_name': 'temperature', 'dev_name': 'thermostat',
+                    'catalog_refresh_interval': 0}
+        settings.update(extra)
+        return settings
+
+    def add_device(self, id, label, commands=('on', 'off'), capabilities=('Switch',), attributes=None, room=None):
+        self.devices[str(id)] = {'id': str(id), 'label': label, 'commands': list(commands), 'room': room,
+                                 'capabilities': list(capabilities), 'attributes': dict(attributes or {})}
+
+    def full_device(self, device):
+        # One entry of /devices/all
+        return {'id': device['id'], 'name': device['label'], 'label': device['label'], 'type': 'Virtual',
+                'room': device['room'], 'capabilities': device['capabilities'], 'attributes': device['attributes'],
+                'commands': [{'command': c} for c in device['commands']]}
+
+    def device_detail(self, device):
+        # The answer to /devices/<id>
+        return {'id': device['id'], 'name': device['label'], 'label': device['label'], 'type': 'Virtual',
+                'capabilities': device['capabilities'], 'commands': device['commands'],
+                'attributes': [{'name': k, 'currentValue': v, 'dataType': 'STRING'}
+                               for k, v in device['attributes'].items()]}
+
+    def command(self, device, command, value):
+        # Carry out a command and return the (attribute, value) events it caused
+        with self._lock:
+            self.commands.append((device['id'], command, value))
+        events = []
+        if command in ('on', 'off'):
+            events.append(('switch', command))
+        elif command == 'setLevel':
+            events.append(('level', value))
+        elif command == 'setThermostatMode':
+            events.append(('thermostatMode', value))
+        for name, new_value in events:
+            device['attributes'][name] = new_value
+        return events
+
+    def post_events(self, device, events):
+        if not self.event_url:
+            return
+        for name, value in events:
+            body = json.dumps({'content': {'name': name, 'value': value, 'displayName': device['label'],
+                                           'deviceId': device['id'], 'descriptionText': None, 'unit': None,
+                                           'type': 'digital', 'data': None}}).encode()
+            try:
+                urlopen(Request(self.event_url, data=body, headers={'Content-Type': 'application/json'}), timeout=2)
+            except OSError:
+                pass
+
+    def respond_normally(self):
+        # Sleep for this request's latency and decide whether it fails
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.latency or self.jitter else 0
+            fail = self.failure_rate and self._random.random() < self.failure_rate
+        if delay:
+            time.sleep(delay)
+        return not fail
+
+    def record(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.commands.clear()
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def start(self):
+        self._thread = Thread(target=self._server.serve_forever, name='fake-maker-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
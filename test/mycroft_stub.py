@@ -0,0 +1,85 @@
+# A stand-in for the parts of Mycroft the skill uses.  The tests and benchmarks run the skill's own code
+# against it, so they behave the same whichever Mycroft or OVOS release is installed, or none at all.
+# Scheduled events are only recorded; tests call the handlers themselves when they want them to run.
+import logging
+import os
+import sys
+import tempfile
+import types
+
+
+class FileSystemAccess:
+    # Like Mycroft's: a directory of the skill's own, here a new temporary one for every skill
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='hubitat-skill-')
+
+    def open(self, filename, mode):
+        return open(os.path.join(self.path, filename), mode)
+
+    def exists(self, filename):
+        return os.path.exists(os.path.join(self.path, filename))
+
+
+class MycroftSkill:
+    def __init__(self, *args, **kwargs):
+        self.settings = {}
+        self.settings_change_callback = None
+        self.log = logging.getLogger('hubitat-skill')
+        self.file_system = FileSystemAccess()
+        self.bus = None
+        self.events = {}
+        self.scheduled = {}
+
+    def speak_dialog(self, key, data=None, **kwargs):
+        pass
+
+    def add_event(self, name, handler, *args, **kwargs):
+        self.events[name] = handler
+
+    def schedule_event(self, handler, when, data=None, name=None):
+        self.scheduled[name] = handler
+
+    def schedule_repeating_event(self, handler, when, frequency, data=None, name=None):
+        self.scheduled[name] = handler
+
+    def cancel_scheduled_event(self, name):
+        self.scheduled.pop(name, None)
+
+    def shutdown(self):
+        pass
+
+
+def intent_file_handler(intent_file):
+    def decorator(func):
+        return func
+    return decorator
+
+
+class Message:
+    def __init__(self, msg_type, data=None, context=None):
+        self.msg_type = msg_type
+        self.data = data or {}
+        self.context = context or {}
+
+    def reply(self, msg_type, data=None, context=None):
+        return Message(msg_type, data, context)
+
+    def response(self, data=None, context=None):
+        return Message(self.msg_type + '.response', data, context)
+
+
+def install():
+    # Make `import mycroft` find the stand-in, in place of any real Mycroft.  This has to happen before the
+    # skill is first imported; doing it again changes nothing.
+    if getattr(sys.modules.get('mycroft'), 'is_stub', False):
+        return
+    mycroft = types.ModuleType('mycroft')
+    mycroft.is_stub = True
+    mycroft.MycroftSkill = MycroftSkill
+    mycroft.intent_file_handler = intent_file_handler
+    messagebus = types.ModuleType('mycroft.messagebus')
+    message = types.ModuleType('mycroft.messagebus.message')
+    message.Message = Message
+    mycroft.messagebus = messagebus
+    messagebus.message = message
+    sys.modules.update({'mycroft': mycroft, 'mycroft.messagebus': messagebus, 'mycroft.messagebus.message': message})
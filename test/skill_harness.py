@@ -0,0 +1,33 @@
+# Starting the skill against a FakeMakerApi the way the tests and benchmarks need it
+from unittest.mock import Mock, patch
+
+import mycroft_stub
+
+mycroft_stub.install()
+from mycroft.messagebus.message import Message  # noqa: E402,F401
+
+from hubitat_integration_skill import HubitatIntegration  # noqa: E402
+
+
+def make_skill(hub, start=True, update=True, **settings):
+    # A skill pointed at `hub` (with any extra settings) whose speech and bus messages are Mocks.  Unless
+    # told otherwise it is started and the catalog is loaded, after which the hub's request counts are
+    # reset so a test only counts its own requests.
+    skill = HubitatIntegration()
+    skill.settings = hub.settings(**settings)
+    skill.speak_dialog = Mock()
+    skill.bus = Mock()
+    if start:
+        start_skill(skill)
+        if update:
+            skill.update_devices()
+            hub.reset()
+    return skill
+
+
+def start_skill(skill):
+    # Initialize and wait for the warm-up.  The scheduled refreshes and health probes are left out: tests
+    # call refresh_catalog and probe_hub themselves when they want them.
+    with patch.object(skill, 'schedule_catalog_refresh'), patch.object(skill, 'schedule_health_probe'):
+        skill.initialize()
+        skill.warmed_up.wait(5)
@@ -0,0 +1,103 @@
+import json
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from hubitat_integration_skill.attribute_store import AttributeStore
+from hubitat_integration_skill.event_listener import EventListener
+
+
+def post_event(port, dev_id, name, value, hub_path="/"):
+    # Posts an event the way the Maker API does
+    body = json.dumps({"content": {"name": name, "value": value, "displayName": "Test Device",
+                                   "deviceId": dev_id, "descriptionText": None, "unit": None,
+                                   "type": None, "data": None}}).encode()
+    req = Request(f"http://127.0.0.1:{port}{hub_path}", data=body, headers={"Content-Type": "application/json"})
+    with urlopen(req, timeout=5) as resp:
+        return resp.status
+
+
+class TestAttributeStore(unittest.TestCase):
+    def test_pulled_values_expire(self):
+        store = AttributeStore(ttl=0.05)
+        store.update_device("12", [{"name": "level", "currentValue": 40}])
+        self.assertEqual(store.get("12", "level"), (True, 40))
+        self.assertEqual(store.get(12, "level"), (True, 40))
+        time.sleep(0.1)
+        self.assertEqual(store.get("12", "level"), (False, None))
+
+    def test_unknown_attribute(self):
+        store = AttributeStore()
+        self.assertEqual(store.get("12", "level"), (False, None))
+
+    def test_pushed_values_need_listener(self):
+        store = AttributeStore(ttl=0)
+        store.push("12", "switch", "on")
+        self.assertEqual(store.get("12", "switch"), (False, None))
+        store.push_active = True
+        self.assertEqual(store.get("12", "switch"), (True, "on"))
+
+    def test_pushed_values_expire_eventually(self):
+        store = AttributeStore(ttl=0, push_ttl=0.05)
+        store.push_active = True
+        store.push("12", "switch", "on")
+        self.assertEqual(store.get("12", "switch"), (True, "on"))
+        time.sleep(0.1)
+        self.assertEqual(store.get("12", "switch"), (False, None))
+
+
+class TestEventListener(unittest.TestCase):
+    def setUp(self):
+        self.store = AttributeStore(ttl=0)
+        # The default hub (None here) and a garage hub, both on this machine
+        self.hub_hosts = {None: "127.0.0.1", "garage": "127.0.0.1"}
+        self.listener = EventListener(self.store, 0, host="127.0.0.1", hub_hosts=lambda: self.hub_hosts)
+        self.listener.start()
+
+    def tearDown(self):
+        self.listener.stop()
+
+    def test_events_update_store(self):
+        self.assertEqual(post_event(self.listener.port, 7, "temperature", "68.5"), 200)
+        self.assertEqual(self.store.get("7", "temperature"), (True, "68.5"))
+        post_event(self.listener.port, 7, "temperature", "70.1")
+        self.assertEqual(self.store.get("7", "temperature"), (True, "70.1"))
+
+    def test_pull_keeps_pushed_attribute_live(self):
+        post_event(self.listener.port, "3", "switch", "off")
+        self.store.update_device("3", [{"name": "switch", "currentValue": "on"}])
+        self.assertEqual(self.store.get("3", "switch"), (True, "on"))
+
+    def test_bad_events_are_ignored(self):
+        req = Request(f"http://127.0.0.1:{self.listener.port}/", data=b"not json")
+        with urlopen(req, timeout=5) as resp:
+            self.assertEqual(resp.status, 200)
+        post_event(self.listener.port, None, "mode", "Home")
+        self.assertEqual(self.store.get("None", "mode"), (False, None))
+
+    def test_events_from_other_hosts_are_refused(self):
+        self.hub_hosts = {None: "192.0.2.7"}
+        with self.assertRaises(HTTPError) as raised:
+            post_event(self.listener.port, 7, "lock", "unlocked")
+        self.assertEqual(raised.exception.code, 403)
+        self.assertEqual(self.store.get("7", "lock"), (False, None))
+
+    def test_events_for_unknown_hubs_are_refused(self):
+        post_event(self.listener.port, 7, "switch", "on", hub_path="/garage")
+        self.assertEqual(self.store.get("7", "switch", "garage"), (True, "on"))
+        with self.assertRaises(HTTPError):
+            post_event(self.listener.port, 7, "switch", "on", hub_path="/attic")
+        self.assertEqual(self.store.get("7", "switch", "attic"), (False, None))
+
+    def test_stop_expires_pushed_values(self):
+        post_event(self.listener.port, "9", "contact", "open")
+        self.listener.stop()
+        self.assertEqual(self.store.get("9", "contact"), (False, None))
+        # tearDown stops it again
+        self.listener = EventListener(self.store, 0, host="127.0.0.1", hub_hosts=lambda: self.hub_hosts)
+        self.listener.start()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+import time
+import unittest
+from os import path
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill import HubitatIntegration
+from hubitat_integration_skill.catalog import Device
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+DEVICES = [
+    {'id': 1, 'label': 'kitchen thermostat', 'room': 'Kitchen', 'attributes': {'temperature': '68.5'}},
+    {'id': 2, 'label': 'bedroom sensor', 'room': 'Bedroom', 'attributes': {'temperature': '64'}},
+    {'id': 3, 'label': 'garage sensor', 'room': 'Garage', 'attributes': {'temperature': '51', 'motion': 'active'}},
+    {'id': 4, 'label': 'hall light', 'room': 'Hall', 'attributes': {'switch': 'on'}},
+]
+
+
+class TestDescribeReadings(unittest.TestCase):
+    def test_numbers(self):
+        readings = [(Device('1', 'den'), '70'), (Device('2', 'porch'), '40.5'), (Device('3', 'attic'), 90)]
+        self.assertEqual(HubitatIntegration.describe_readings(readings),
+                         ('attr.all.range', {'count': 3, 'min': '40.5', 'min_device': 'porch', 'max': '90',
+                                             'max_device': 'attic', 'average': '66.8'}))
+
+    def test_words(self):
+        readings = [(Device(str(i), f"light {i}"), 'off') for i in range(5)] + \
+                   [(Device('9', 'den lamp'), 'on'), (Device('8', 'attic lamp'), 'on')]
+        self.assertEqual(HubitatIntegration.describe_readings(readings),
+                         ('attr.all.list', {'count': 7, 'values': "off for 5 devices, on for attic lamp and den lamp"}))
+
+
+class TestBulkAttributes(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi(DEVICES).start()
+        self.skill = make_skill(self.hub, attr_name='temperature,switch', dev_name='kitchen thermostat,hall light')
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def test_answered_from_the_store(self):
+        # The rescan put every value in the attribute store, so the hub is not asked at all
+        self.skill.handle_attr_all_intent(Message('', {'attr': 'temperatures'}))
+        self.assertEqual(self.hub.total_requests, 0)
+        self.skill.speak_dialog.assert_called_once_with(
+            'attr.all.range', data={'count': 3, 'min': '51', 'min_device': 'garage sensor', 'max': '68.5',
+                                    'max_device': 'kitchen thermostat', 'average': '61.2', 'attr': 'temperature'})
+
+    def test_one_request_when_stale(self):
+        self.skill.attr_store.ttl = 0.05
+        time.sleep(0.1)
+        self.hub.devices['3']['attributes']['temperature'] = '49'
+        self.skill.handle_attr_all_intent(Message('', {'attr': 'temperature'}))
+        self.assertEqual(dict(self.hub.requests), {'devices/all': 1})
+        self.assertEqual(self.skill.speak_dialog.call_args[1]['data']['min'], '49')
+
+    def test_cache_turned_off(self):
+        # Every stored value is stale at once, so the answer has to come from the fetch itself
+        self.skill.shutdown()
+        self.skill = make_skill(self.hub, attribute_cache_ttl=0, attr_name='temperature',
+                                dev_name='kitchen thermostat')
+        self.skill.handle_attr_all_intent(Message('', {'attr': 'temperature'}))
+        self.assertEqual(dict(self.hub.requests), {'devices/all': 1})
+        self.assertEqual(self.skill.speak_dialog.call_args[0][0], 'attr.all.range')
+        self.assertEqual(self.skill.speak_dialog.call_args[1]['data']['count'], 3)
+
+    def test_devices_without_a_reading(self):
+        # An offline sensor has no value, which leaves the others to be summed up as numbers
+        self.hub.devices['5'] = {'id': 5, 'label': 'porch sensor', 'room': 'Porch', 'commands': [],
+                                 'capabilities': [], 'attributes': {'temperature': None}}
+        self.skill.update_devices()
+        self.skill.handle_attr_all_intent(Message('', {'attr': 'temperature'}))
+        self.assertEqual(self.skill.speak_dialog.call_args[0][0], 'attr.all.range')
+        self.assertEqual(self.skill.speak_dialog.call_args[1]['data']['count'], 3)
+
+    def test_single_device(self):
+        self.skill.handle_attr_all_intent(Message('', {'attr': 'switch'}))
+        self.skill.speak_dialog.assert_called_once_with('attr', data={'device': 'hall light', 'attr': 'switch',
+                                                                      'value': 'on'})
+
+    def test_reporting_index(self):
+        self.assertEqual([d.label for d in self.skill.catalog.reporting('motion')], ['garage sensor'])
+        self.assertEqual(self.skill.catalog.reporting('humidity'), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
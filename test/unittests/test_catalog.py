@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from hubitat_integration_skill.catalog import TEST_DEVICES, Device, DeviceCatalog, iter_json_array, stream_devices
+
+DEVICES = [
+    {"id": "1", "name": "Dimmer", "label": "Kitchen Light", "room": "Kitchen", "type": "Generic Z-Wave Dimmer",
+     "capabilities": ["Switch", {"attributes": [{"name": "switch", "dataType": None}]}, "SwitchLevel"],
+     "attributes": {"switch": "off", "level": "40"},
+     "commands": [{"command": "on"}, {"command": "off"}, {"command": "setLevel"}]},
+    {"id": "2", "name": "Thermostat", "label": "Café Thermostat ❄", "room": None,
+     "capabilities": ["Thermostat"], "attributes": {"supportedThermostatModes": "[heat, cool]"},
+     "commands": [{"command": "setThermostatMode"}]},
+    {"id": "3", "name": "Hub variable", "label": None, "commands": []},
+]
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+class TestStreamingParse(unittest.TestCase):
+    def test_any_chunk_boundary(self):
+        payload = json.dumps(DEVICES, indent=1, ensure_ascii=False).encode()
+        for size in (1, 2, 3, 7, 64, len(payload)):
+            self.assertEqual(list(iter_json_array(chunked(payload, size))), DEVICES)
+
+    def test_numbers_split_across_chunks(self):
+        self.assertEqual(list(iter_json_array([b"[12", b"3, 4", b"5.", b"5e1", b"]"])), [123, 455.0])
+        for size in (1, 2, 3):
+            self.assertEqual(list(iter_json_array(chunked(b"[123, -4.5, true, null, 67]", size))),
+                             [123, -4.5, True, None, 67])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array([b" [ ", b"]"])), [])
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"error": true, "type": "AppException"}']))
+
+    def test_truncated(self):
+        payload = json.dumps(DEVICES).encode()
+        with self.assertRaises(ValueError):
+            list(iter_json_array(chunked(payload[:-40], 16)))
+
+    def test_devices_keep_what_the_skill_uses(self):
+        devices = list(stream_devices(chunked(json.dumps(DEVICES).encode(), 5)))
+        self.assertEqual([d.label for d in devices], ["Kitchen Light", "Café Thermostat ❄"])
+        light = devices[0]
+        self.assertEqual(light.id, "1")
+        self.assertEqual(light.room, "Kitchen")
+        self.assertEqual(light.commands, {"on", "off", "setLevel"})
+        self.assertEqual(light.capabilities, {"Switch", "SwitchLevel"})
+        self.assertEqual(light.attributes["level"], "40")
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        devices = list(stream_devices([json.dumps(DEVICES).encode()]))
+        self.catalog = DeviceCatalog(list(TEST_DEVICES) + devices, min_score=65)
+
+    def test_lookups(self):
+        self.assertEqual(self.catalog.get("Kitchen Light").id, "1")
+        self.assertEqual(self.catalog.by_id[(None, "1")].label, "Kitchen Light")
+        self.assertEqual(self.catalog.find("the Kitchen Light please").id, "1")
+        self.assertIsNone(self.catalog.find("garage"))
+        self.assertEqual(self.catalog.get("testLevelDev").id, "**testLevel")
+
+    def test_diff_and_apply(self):
+        fresh = [Device("1", "Kitchen Lamp", ["on", "off"]), Device("4", "Porch Light", ["on", "off"])]
+        diff = self.catalog.diff(fresh)
+        self.assertEqual(diff.added, ["Porch Light"])
+        self.assertEqual(diff.removed, ["Café Thermostat ❄"])
+        self.assertEqual(diff.renamed, [("Kitchen Light", "Kitchen Lamp")])
+        catalog = self.catalog.apply(diff, fresh)
+        self.assertEqual(sorted(d.label for d in catalog if not d.is_test), ["Kitchen Lamp", "Porch Light"])
+        self.assertEqual(catalog.index.match("porch lights")[0], "Porch Light")
+        self.assertEqual(catalog.diff(fresh), ([], [], [], []))
+
+    def test_snapshot_round_trip(self):
+        snapshot = json.loads(json.dumps(self.catalog.to_snapshot("hub")))
+        catalog = DeviceCatalog.from_snapshot(snapshot, "hub", 65)
+        self.assertEqual(catalog.get("Kitchen Light").commands, {"on", "off", "setLevel"})
+        self.assertEqual(len(catalog), len(self.catalog))
+        self.assertIsNone(DeviceCatalog.from_snapshot(snapshot, "other hub", 65))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from threading import Event, Lock
+from unittest.mock import Mock, patch
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill.command_queue import CommandQueue
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+
+class Recorder:
+    # A send function that remembers what it was asked to send
+    def __init__(self, delay=0.0):
+        self.sent = []
+        self.delay = delay
+        self.sending = Event()
+        self._lock = Lock()
+
+    def __call__(self, key, command, value):
+        self.sending.set()
+        time.sleep(self.delay)
+        with self._lock:
+            self.sent.append((key, command, value))
+        return f"{command} {value}"
+
+
+class TestCommandQueue(unittest.TestCase):
+    def setUp(self):
+        self.send = Recorder()
+        self.pool = ThreadPoolExecutor(4)
+        self.queue = CommandQueue(self.send, self.pool, window=0.05)
+
+    def tearDown(self):
+        self.queue.close()
+        self.pool.shutdown()
+
+    def test_later_level_replaces_earlier(self):
+        futures = [self.queue.submit('lamp', 'setLevel', level) for level in (20, 30, 40)]
+        self.assertTrue(self.queue.drain(2))
+        self.assertEqual(self.send.sent, [('lamp', 'setLevel', 40)])
+        self.assertEqual([f.result() for f in futures], ["setLevel 40"] * 3)
+
+    def test_on_and_off_replace_each_other_and_order_is_kept(self):
+        self.queue.submit('lamp', 'off')
+        self.queue.submit('lamp', 'setLevel', 40)
+        self.queue.submit('lamp', 'on')
+        self.queue.drain(2)
+        self.assertEqual(self.send.sent, [('lamp', 'setLevel', 40), ('lamp', 'on', None)])
+
+    def test_other_commands_are_all_sent(self):
+        self.queue.submit('button', 'push', 1)
+        self.queue.submit('button', 'push', 1)
+        self.queue.drain(2)
+        self.assertEqual(len(self.send.sent), 2)
+
+    def test_devices_are_separate(self):
+        self.queue.submit('lamp', 'on')
+        self.queue.submit('fan', 'on')
+        self.queue.drain(2)
+        self.assertEqual(sorted(key for key, _, _ in self.send.sent), ['fan', 'lamp'])
+
+    def test_commands_queued_while_sending_go_next(self):
+        self.send.delay = 0.1
+        self.queue.submit('lamp', 'setLevel', 10)
+        self.assertTrue(self.send.sending.wait(2))
+        self.queue.submit('lamp', 'setLevel', 20)
+        self.queue.submit('lamp', 'setLevel', 30)
+        self.queue.drain(2)
+        self.assertEqual(self.send.sent, [('lamp', 'setLevel', 10), ('lamp', 'setLevel', 30)])
+
+    def test_errors_reach_the_future(self):
+        queue = CommandQueue(Mock(side_effect=ValueError("boom")), self.pool, window=0)
+        future = queue.submit('lamp', 'on')
+        self.assertIsInstance(future.exception(2), ValueError)
+        queue.close()
+
+    def test_close_sends_what_is_waiting(self):
+        queue = CommandQueue(self.send, self.pool, window=60)
+        future = queue.submit('lamp', 'on')
+        queue.close()
+        self.assertEqual(future.result(2), "on None")
+        with self.assertRaises(RuntimeError):
+            queue.submit('lamp', 'off')
+
+
+class TestQueuedIntents(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi([{'id': 1, 'label': 'kitchen light', 'commands': ['on', 'off', 'setLevel']}],
+                                latency=0.05).start()
+        self.skill = make_skill(self.hub, command_debounce_ms=100)
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def test_intent_returns_before_the_hub_answers(self):
+        start = time.perf_counter()
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.assertLess(time.perf_counter() - start, 0.05)
+        self.skill.speak_dialog.assert_called_once_with('ok', data={'device': 'kitchen light'})
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.commands, [('1', 'on', None)])
+        self.skill.speak_dialog.assert_called_once()
+
+    def test_rapid_level_changes_cost_one_request(self):
+        for level in ('20', '30', '40'):
+            self.skill.handle_level_intent(Message('', {'device': 'kitchen light', 'level': level}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.commands, [('1', 'setLevel', '40')])
+
+    def test_failure_is_reported_later(self):
+        self.hub.failure_rate = 1.0
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.command_queue.drain()
+        self.skill.speak_dialog.assert_called_with('command.failed', data={'device': 'kitchen light',
+                                                                           'command': 'on'})
+
+    def test_settings_change_while_a_command_is_submitted(self):
+        # The intent picked up the queue just before a settings change replaced it
+        old = self.skill.command_queue
+        submit = old.submit
+
+        def settings_change_first(*args, **kwargs):
+            self.skill.on_settings_changed()
+            self.assertIsNotNone(self.skill.command_queue)
+            return submit(*args, **kwargs)
+
+        with patch.object(old, 'submit', side_effect=settings_change_first):
+            self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.assertIsNot(self.skill.command_queue, old)
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.commands, [('1', 'on', None)])
+        self.skill.speak_dialog.assert_called_once_with('ok', data={'device': 'kitchen light'})
+
+    def test_command_over_the_bus(self):
+        done = Event()
+        self.skill.bus.emit.side_effect = lambda message: done.set()
+        self.skill.handle_device_command(Message('hubitat.device.command',
+                                                 {'device': 'kitchen lights', 'command': 'setLevel', 'value': 25}))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(self.skill.bus.emit.call_args[0][0].data,
+                         {'device': 'kitchen light', 'command': 'setLevel', 'ok': True})
+        self.assertEqual(self.hub.commands, [('1', 'setLevel', '25')])
+
+    def test_bus_command_with_a_zero_value(self):
+        done = Event()
+        self.skill.bus.emit.side_effect = lambda message: done.set()
+        self.skill.handle_device_command(Message('hubitat.device.command',
+                                                 {'device': 'kitchen light', 'command': 'setLevel', 'value': 0}))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(self.hub.commands, [('1', 'setLevel', '0')])
+
+    def test_bus_command_the_device_does_not_have(self):
+        self.skill.handle_device_command(Message('hubitat.device.command', {'device': 'kitchen light',
+                                                                            'command': 'setThermostatMode'}))
+        self.assertFalse(self.skill.bus.emit.call_args[0][0].data['ok'])
+
+
+if __name__ == "__main__":
+    unittest.main()
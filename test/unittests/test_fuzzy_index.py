@@ -0,0 +1,79 @@
+import random
+import unittest
+
+from fuzzywuzzy import fuzz
+
+from hubitat_integration_skill.fuzzy_index import FuzzyIndex
+
+ROOMS = ["kitchen", "living room", "bedroom", "garage", "office", "hall", "porch", "basement", "attic", "den"]
+THINGS = ["light", "lamp", "outlet", "fan", "switch", "dimmer", "heater", "thermostat", "sensor", "Strip!"]
+
+
+def linear(labels, text, min_score):
+    # What the skill did before the index: token_sort_ratio against every label, first best wins
+    best_name, best_score = None, 0
+    for label in labels:
+        score = fuzz.token_sort_ratio(label, text)
+        if score > best_score:
+            best_name, best_score = label, score
+    if best_score <= min_score:
+        return None, best_score
+    return best_name, best_score
+
+
+class TestFuzzyIndex(unittest.TestCase):
+    def test_same_answer_as_a_linear_scan(self):
+        rnd = random.Random(7)
+        for _ in range(40):
+            labels = list(dict.fromkeys(f"{rnd.choice(ROOMS)} {rnd.choice(THINGS)} {rnd.randint(1, 30)}"
+                                        for _ in range(rnd.randint(1, 60))))
+            min_score = rnd.choice([0, 40, 65, 80, 95])
+            index = FuzzyIndex(labels, min_score)
+            for _ in range(10):
+                words = rnd.choice(labels).split()
+                rnd.shuffle(words)
+                text = " ".join(rnd.sample(words, rnd.randint(1, len(words))) + rnd.sample(THINGS, rnd.randint(0, 1)))
+                expected_name, expected_score = linear(labels, text, min_score)
+                name, score = index.match(text)
+                if expected_name is None:
+                    self.assertIsNone(name, text)
+                    self.assertLessEqual(score, min_score, text)
+                else:
+                    # Labels that tie may be found in any order, as long as they really score the same
+                    self.assertEqual(score, expected_score, text)
+                    self.assertEqual(fuzz.token_sort_ratio(name, text), expected_score, text)
+
+    def test_score_at_the_minimum_is_not_a_match(self):
+        index = FuzzyIndex(["kitchen light"])
+        score = fuzz.token_sort_ratio("kitchen light", "kitchen")
+        index.set_min_score(score)
+        self.assertIsNone(index.match("kitchen")[0])
+        index.set_min_score(score - 1)
+        self.assertEqual(index.match("kitchen"), ("kitchen light", score))
+
+    def test_least_recently_used_utterance_is_dropped(self):
+        index = FuzzyIndex(["kitchen light", "porch light"], cache_size=2)
+        index.match("kitchen")
+        index.match("porch")
+        index.match("kitchen")
+        index.match("light porch")
+        self.assertEqual(list(index._cache), ["kitchen", "light porch"])
+
+    def test_min_score_change_empties_the_cache(self):
+        index = FuzzyIndex(["kitchen light"], min_score=95)
+        self.assertEqual(index.match("kitchen lite")[0], None)
+        index.set_min_score(65)
+        self.assertEqual(index._cache, {})
+        self.assertEqual(index.match("kitchen lite")[0], "kitchen light")
+
+    def test_updated_index(self):
+        index = FuzzyIndex(["kitchen light", "porch light"], min_score=65)
+        index.match("porch light")
+        updated = index.updated(added=["garage light"], removed=["porch light"])
+        self.assertNotEqual(updated.match("porch light")[0], "porch light")
+        self.assertEqual(updated.match("garage light"), ("garage light", 100))
+        self.assertEqual(index.match("porch light"), ("porch light", 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import sys
+import time
+import unittest
+from os import path
+from unittest.mock import patch
+
+from mycroft.messagebus.message import Message
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+DEVICES = [
+    {'id': 1, 'label': 'kitchen light', 'commands': ['on', 'off', 'setLevel'], 'room': 'Kitchen'},
+    {'id': 2, 'label': 'kitchen fan', 'commands': ['on', 'off'], 'room': 'Kitchen'},
+    {'id': 3, 'label': 'hall light', 'commands': ['on', 'off', 'setLevel'], 'room': 'Hall'},
+    {'id': 4, 'label': 'bedroom lamp', 'commands': ['on', 'off'], 'room': 'Bedroom'},
+    {'id': 5, 'label': 'thermostat', 'commands': ['setThermostatMode'], 'capabilities': ['Thermostat'],
+     'room': 'Hall'},
+]
+
+
+class TestGroupCommands(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hub = FakeMakerApi(DEVICES).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hub.stop()
+
+    def setUp(self):
+        self.skill = make_skill(
+            self.hub, device_groups="downstairs: kitchen light, kitchen fan, hall light; upstairs: bedroom lamp",
+            max_parallel_commands=8)
+
+    def tearDown(self):
+        self.skill.shutdown()
+
+    def switched(self):
+        return sorted(dev_id for dev_id, _, _ in self.hub.commands)
+
+    def test_all_of_a_kind(self):
+        self.skill.handle_group_off_intent(Message('', {'group': 'lights'}))
+        self.assertEqual(self.switched(), ['1', '3'])
+        self.skill.speak_dialog.assert_called_once_with('group.ok', data={'group': 'lights', 'count': 2})
+
+    def test_everything_in_a_room(self):
+        self.skill.handle_group_on_intent(Message('', {'room': 'the kitchen'}))
+        self.assertEqual(self.switched(), ['1', '2'])
+
+    def test_kind_in_a_room(self):
+        self.skill.handle_group_level_intent(Message('', {'group': 'lights', 'room': 'hall', 'level': '30'}))
+        self.assertEqual(self.hub.commands, [('3', 'setLevel', '30')])
+
+    def test_named_group(self):
+        self.skill.handle_group_off_intent(Message('', {'group': 'downstairs'}))
+        self.assertEqual(self.switched(), ['1', '2', '3'])
+
+    def test_named_group_heard_as_a_room(self):
+        # "Turn off everything downstairs"
+        self.skill.handle_group_off_intent(Message('', {'room': 'downstairs'}))
+        self.assertEqual(self.switched(), ['1', '2', '3'])
+        self.skill.speak_dialog.assert_called_once_with('group.ok', data={'group': 'downstairs', 'count': 3})
+
+    def test_kind_in_a_named_group(self):
+        # "Turn off all the lights downstairs"
+        self.skill.handle_group_off_intent(Message('', {'group': 'lights', 'room': 'downstairs'}))
+        self.assertEqual(self.switched(), ['1', '3'])
+
+    def test_devices_without_the_command_are_skipped(self):
+        self.skill.handle_group_off_intent(Message('', {'group': 'everything'}))
+        self.assertEqual(self.switched(), ['1', '2', '3', '4'])
+
+    def test_nothing_matches(self):
+        self.skill.handle_group_off_intent(Message('', {'group': 'sprinklers'}))
+        self.assertEqual(self.hub.total_requests, 0)
+        self.skill.speak_dialog.assert_called_once_with('group.not.found', data={'group': 'sprinklers'})
+
+    def test_partial_failure(self):
+        real = self.skill.access_hubitat
+
+        def flaky(part_url, timeout=None, quiet=False, hub=None):
+            return "" if "/devices/2/" in part_url else real(part_url, timeout, quiet, hub)
+
+        with patch.object(self.skill, 'access_hubitat', side_effect=flaky):
+            self.skill.handle_group_on_intent(Message('', {'room': 'kitchen'}))
+        self.skill.speak_dialog.assert_called_once_with('group.partial',
+                                                        data={'group': 'kitchen', 'count': 2, 'failed': 1})
+
+    def test_commands_run_concurrently(self):
+        def slow(part_url, timeout=None, quiet=False, hub=None):
+            time.sleep(0.2)
+            return "{}"
+
+        with patch.object(self.skill, 'access_hubitat', side_effect=slow) as access:
+            start = time.monotonic()
+            self.skill.handle_group_off_intent(Message('', {'group': 'everything'}))
+            elapsed = time.monotonic() - start
+        self.assertEqual(access.call_count, 4)
+        self.skill.speak_dialog.assert_called_once_with('group.ok', data={'group': 'everything', 'count': 4})
+        # Four devices at 0.2s each would take 0.8s one after the other
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import socket
+import sys
+import time
+import unittest
+from os import path
+from unittest.mock import Mock, patch
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill.hub_health import AddressCache, CircuitBreaker
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+
+class TestAddressCache(unittest.TestCase):
+    def test_cached_until_ttl(self):
+        resolver = Mock(side_effect=['10.0.0.2', '10.0.0.3'])
+        cache = AddressCache(ttl=0.05, resolver=resolver)
+        self.assertEqual(cache.resolve('hubitat.local'), '10.0.0.2')
+        self.assertEqual(cache.resolve('hubitat.local'), '10.0.0.2')
+        self.assertEqual(resolver.call_count, 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.resolve('hubitat.local'), '10.0.0.3')
+
+    def test_keeps_last_good_address(self):
+        resolver = Mock(side_effect=['10.0.0.2', socket.gaierror()])
+        cache = AddressCache(resolver=resolver)
+        cache.resolve('hubitat.local')
+        self.assertEqual(cache.resolve('hubitat.local', refresh=True), '10.0.0.2')
+
+    def test_never_resolved(self):
+        cache = AddressCache(resolver=Mock(side_effect=socket.gaierror()))
+        self.assertIsNone(cache.peek('hubitat.local'))
+        with self.assertRaises(socket.error):
+            cache.resolve('hubitat.local')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_count(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+
+    def test_half_open_lets_one_request_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+
+class TestUnreachableHub(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi([{'id': 1, 'label': 'kitchen light'}]).start()
+        self.skill = make_skill(self.hub, breaker_failure_threshold=2, breaker_reset_timeout=60)
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def take_hub_down(self):
+        # Point the skill at a port nobody listens on
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.skill.default_hub.address = f"127.0.0.1:{port}"
+
+    def test_fails_fast_while_hub_is_down(self):
+        self.take_hub_down()
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.command_queue.drain()
+        self.skill.speak_dialog.assert_called_with('command.failed', data={'device': 'kitchen light',
+                                                                           'command': 'on'})
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.command_queue.drain()
+        self.skill.speak_dialog.assert_called_with('hub.unreachable')
+        self.skill.speak_dialog.reset_mock()
+        with patch.object(self.skill.default_hub.session, 'get') as get:
+            self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+            self.skill.command_queue.drain()
+            get.assert_not_called()
+        # No "okay" first: the breaker is open, so nothing is confirmed before the hub answers
+        self.skill.speak_dialog.assert_called_once_with('hub.unreachable')
+
+    def test_settings_change_to_a_host_that_does_not_resolve(self):
+        self.skill.settings['local_address'] = 'hub.invalid'
+        with patch.object(self.skill, 'schedule_catalog_refresh'), \
+                patch.object(self.skill, 'schedule_health_probe'):
+            self.skill.on_settings_changed()
+        self.assertFalse(self.skill.configured)
+        self.assertEqual(self.skill.default_hub.address, 'hub.invalid')
+        # Whatever is still scheduled fails like it would with the hub down
+        self.skill.refresh_catalog()
+        self.assertEqual(self.skill.access_hubitat(self.skill.default_hub.api_url('devices/all')), "")
+        self.skill.speak_dialog.assert_called_with('url.error')
+
+    def test_probe_closes_breaker_when_hub_is_back(self):
+        good = self.skill.default_hub.address
+        self.take_hub_down()
+        for _ in range(2):
+            self.skill.access_hubitat("/apps/api/1/devices/1/on", quiet=True)
+        self.assertFalse(self.skill.default_hub.breaker.allow())
+        self.skill.default_hub.address = good
+        self.skill.probe_hub()
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.command_queue.drain()
+        self.skill.speak_dialog.assert_called_with('ok', data={'device': 'kitchen light'})
+
+
+class TestHubDownAtStartup(unittest.TestCase):
+    # No snapshot and no answer from the hub: intents must not sit through timeouts or claim that the
+    # devices do not exist
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.hub = FakeMakerApi([{'id': 1, 'label': 'kitchen light'}]).start()
+        self.skill = make_skill(self.hub, update=False, local_address=f"127.0.0.1:{port}",
+                                breaker_failure_threshold=1, breaker_reset_timeout=60)
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def test_no_wait_while_the_breaker_is_open(self):
+        self.skill.default_hub.breaker.failure()
+        start = time.perf_counter()
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.skill.speak_dialog.assert_called_once_with('hub.unreachable')
+
+    def test_failed_first_refresh_releases_intents(self):
+        self.skill.refresh_catalog()
+        self.assertTrue(self.skill.catalog_ready.is_set())
+        self.skill.handle_group_off_intent(Message('', {'group': 'lights'}))
+        self.skill.speak_dialog.assert_called_once_with('hub.unreachable')
+
+
+if __name__ == "__main__":
+    unittest.main()
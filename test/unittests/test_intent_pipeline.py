@@ -0,0 +1,72 @@
+import sys
+import unittest
+from os import path
+
+from mycroft.messagebus.message import Message
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+DEVICES = [
+    {'id': 1, 'label': 'kitchen light', 'commands': ['on', 'off', 'setLevel'], 'attributes': {'switch': 'off'}},
+    {'id': 2, 'label': 'porch light', 'commands': ['on', 'off'], 'attributes': {'switch': 'off'}},
+    {'id': 3, 'label': 'thermostat', 'commands': ['setThermostatMode', 'setHeatingSetpoint'],
+     'capabilities': ['Thermostat'],
+     'attributes': {'supportedThermostatModes': '[heat, cool, auto, off]', 'temperature': '68'}},
+]
+
+
+class TestIntentPipeline(unittest.TestCase):
+    # Every on/off/level intent should cost exactly one request to the hub: the command itself.  Commands
+    # are sent in the background, so the tests wait for the queue before counting.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hub = FakeMakerApi(DEVICES).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hub.stop()
+
+    def setUp(self):
+        self.skill = make_skill(self.hub)
+
+    def tearDown(self):
+        self.skill.shutdown()
+
+    def test_on_and_off(self):
+        self.skill.handle_on_intent(Message('', {'device': 'the kitchen lights'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.total_requests, 1)
+        self.assertEqual(self.hub.commands, [('1', 'on', None)])
+        self.skill.handle_off_intent(Message('', {'device': 'porch light'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.total_requests, 2)
+        self.skill.speak_dialog.assert_called_with('ok', data={'device': 'porch light'})
+
+    def test_set_level(self):
+        self.skill.handle_level_intent(Message('', {'device': 'kitchen light', 'level': '40'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.total_requests, 1)
+        self.assertEqual(self.hub.commands, [('1', 'setLevel', '40')])
+
+    def test_thermostat_mode(self):
+        self.skill.handle_level_intent(Message('', {'device': 'the thermostat', 'level': 'cool'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.total_requests, 1)
+        self.assertEqual(self.hub.commands, [('3', 'setThermostatMode', 'cool')])
+
+    def test_unsupported_command_sends_nothing(self):
+        self.skill.handle_level_intent(Message('', {'device': 'porch light', 'level': '40'}))
+        self.assertEqual(self.hub.total_requests, 0)
+        self.skill.speak_dialog.assert_called_with('command.not.supported',
+                                                   data={'device': 'porch light', 'command': 'setLevel'})
+
+    def test_unknown_device_sends_nothing(self):
+        self.skill.handle_on_intent(Message('', {'device': 'garage door opener'}))
+        self.assertEqual(self.hub.total_requests, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+from unittest.mock import patch
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill.HubitatIntegration import endpoint_name
+from hubitat_integration_skill.metrics import Metrics
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+
+class TestMetrics(unittest.TestCase):
+    def test_disabled_records_nothing(self):
+        metrics = Metrics()
+        with metrics.timer('x'):
+            pass
+        metrics.count('y')
+        metrics.hit('z', True)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {})
+        self.assertEqual(snapshot['latency'], {})
+
+    def test_histogram_and_hit_rate(self):
+        metrics = Metrics(enabled=True)
+        for ms in (0.5, 3, 3, 40, 700):
+            metrics.observe('call', ms / 1000)
+        metrics.hit('cache', True)
+        metrics.hit('cache', True)
+        metrics.hit('cache', False)
+        metrics.hit('cold', False)
+        snapshot = metrics.snapshot()
+        call = snapshot['latency']['call']
+        self.assertEqual(call['count'], 5)
+        self.assertEqual(call['p50_ms'], 5)
+        self.assertEqual(call['max_ms'], 700)
+        self.assertEqual(snapshot['hit_rates'], {'cache': 0.6667, 'cold': 0.0})
+
+    def test_timer_counts_errors(self):
+        metrics = Metrics(enabled=True)
+        with self.assertRaises(ValueError):
+            with metrics.timer('boom'):
+                raise ValueError()
+        self.assertEqual(metrics.snapshot()['counters'], {'boom.error': 1})
+
+    def test_endpoint_name(self):
+        self.assertEqual(endpoint_name('/apps/api/12/devices/all'), 'devices/all')
+        self.assertEqual(endpoint_name('/apps/api/12/devices/34'), 'devices/<id>')
+        self.assertEqual(endpoint_name('/apps/api/12/devices/34/setLevel/40'), 'devices/<id>/<command>')
+
+
+class TestSkillMetrics(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hub = FakeMakerApi([{'id': 1, 'label': 'kitchen light', 'commands': ['on', 'off'],
+                                 'attributes': {'temperature': '70'}}]).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hub.stop()
+
+    def setUp(self):
+        self.skill = make_skill(self.hub, enable_metrics=True)
+
+    def tearDown(self):
+        self.skill.metrics.enabled = False
+        self.skill.shutdown()
+
+    def test_intent_and_hub_calls_are_timed(self):
+        for _ in range(2):
+            self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+            self.skill.command_queue.drain()
+        snapshot = self.skill.metrics.snapshot()
+        self.assertEqual(snapshot['latency']['intent.on']['count'], 2)
+        self.assertEqual(snapshot['latency']['hub.devices/<id>/<command>']['count'], 2)
+        self.assertEqual(snapshot['latency']['hub.devices/all']['count'], 1)
+        self.assertEqual(snapshot['latency']['catalog.refresh']['count'], 1)
+        self.assertEqual(snapshot['hit_rates']['resolve.device_cache'], 0.5)
+
+    def test_metrics_over_the_bus(self):
+        self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.handle_metrics_get(Message('hubitat.metrics.get'))
+        response = self.skill.bus.emit.call_args[0][0]
+        self.assertIn('intent.on', response.data['latency'])
+
+        self.skill.handle_metrics_dump(Message('hubitat.metrics.dump', {'path': 'intents.json'}))
+        dump = os.path.join(self.skill.file_system.path, 'intents.json')
+        self.assertEqual(self.skill.bus.emit.call_args[0][0].data, {'path': os.path.realpath(dump)})
+        with open(dump) as f:
+            self.assertIn('intent.on', json.load(f)['latency'])
+
+        self.skill.handle_metrics_reset(Message('hubitat.metrics.reset'))
+        self.assertEqual(self.skill.metrics.snapshot()['latency'], {})
+
+    def test_dump_stays_in_the_skill_directory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            outside = os.path.join(tmp, 'metrics.json')
+            relative = os.path.relpath(os.path.join(tmp, 'escaped.json'), self.skill.file_system.path)
+            for given in (outside, relative):
+                self.skill.handle_metrics_dump(Message('hubitat.metrics.dump', {'path': given}))
+                self.assertIn('error', self.skill.bus.emit.call_args[0][0].data)
+            self.assertEqual(os.listdir(tmp), [])
+
+    def test_shutdown_goes_on_when_metrics_cannot_be_written(self):
+        queue = self.skill.command_queue
+        with patch.object(self.skill.metrics, 'dump', side_effect=OSError("read-only")):
+            self.skill.shutdown()
+        self.assertIsNone(self.skill.command_queue)
+        with self.assertRaises(RuntimeError):
+            queue.submit('lamp', 'on')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import json
+import socket
+import sys
+import time
+import unittest
+from os import path
+from unittest.mock import patch
+from urllib.request import Request, urlopen
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill.catalog import Device, DeviceCatalog, TEST_DEVICES
+from hubitat_integration_skill.hub import DEFAULT_HUB, parse_hubs
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+
+class TestParseHubs(unittest.TestCase):
+    def test_single_hub_settings(self):
+        hubs = parse_hubs({'local_address': '10.0.0.2', 'hubitat_maker_api_app_id': 7, 'access_token': 'abc'})
+        self.assertEqual(hubs, [(DEFAULT_HUB, '10.0.0.2', 7, 'abc')])
+
+    def test_list(self):
+        hubs = parse_hubs({'hubs': [{'name': 'upstairs', 'local_address': '10.0.0.2',
+                                     'hubitat_maker_api_app_id': 7, 'access_token': 'abc'},
+                                    {'local_address': '10.0.0.3', 'hubitat_maker_api_app_id': 8,
+                                     'access_token': 'def'},
+                                    {'local_address': '10.0.0.4'}]})
+        self.assertEqual(hubs, [('upstairs', '10.0.0.2', 7, 'abc'), ('hub2', '10.0.0.3', 8, 'def')])
+
+    def test_text(self):
+        hubs = parse_hubs({'hubs': '"upstairs: 10.0.0.2:8080, 7, abc"; garage: 10.0.0.3, 8, def; broken: 1'})
+        self.assertEqual(hubs, [('upstairs', '10.0.0.2:8080', '7', 'abc'), ('garage', '10.0.0.3', '8', 'def')])
+
+
+class TestMerge(unittest.TestCase):
+    def test_first_hub_wins_a_shared_label(self):
+        first = DeviceCatalog(list(TEST_DEVICES) + [Device("1", "porch light", ["on"], hub="a")])
+        second = DeviceCatalog(list(TEST_DEVICES) + [Device("1", "porch light", ["on"], hub="b"),
+                                                     Device("2", "garage door", ["open"], hub="b")])
+        merged = DeviceCatalog.merge([first, second])
+        self.assertEqual(merged.get("porch light").hub, "a")
+        self.assertEqual(len(merged.by_id), 3)
+        self.assertEqual({hub: len(shard.by_id) for hub, shard in merged.split().items()}, {"a": 1, "b": 2})
+
+    def test_single_hub_is_not_copied(self):
+        catalog = DeviceCatalog(list(TEST_DEVICES) + [Device("1", "porch light", hub="a")])
+        self.assertIs(DeviceCatalog.merge([catalog]), catalog)
+        self.assertIs(catalog.split()["a"], catalog)
+
+
+class TestMultipleHubs(unittest.TestCase):
+    def setUp(self):
+        self.house = FakeMakerApi([{'id': 1, 'label': 'kitchen light', 'room': 'Kitchen',
+                                    'commands': ['on', 'off', 'setLevel']},
+                                   {'id': 2, 'label': 'hall light', 'room': 'Hall'}],
+                                  app_id='10', token='house-token', latency=0.2).start()
+        self.garage = FakeMakerApi([{'id': 1, 'label': 'garage light', 'room': 'Garage',
+                                     'attributes': {'switch': 'off'}},
+                                    {'id': 2, 'label': 'workbench outlet', 'room': 'Garage'}],
+                                   app_id='20', token='garage-token', latency=0.2).start()
+        self.skill = make_skill(self.house, update=False, hubs=[
+            {'name': 'house', 'local_address': self.house.address, 'hubitat_maker_api_app_id': '10',
+             'access_token': 'house-token'},
+            {'name': 'garage', 'local_address': self.garage.address, 'hubitat_maker_api_app_id': '20',
+             'access_token': 'garage-token'}])
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.house.stop()
+        self.garage.stop()
+
+    def test_rescan_fans_out(self):
+        start = time.perf_counter()
+        self.assertEqual(self.skill.update_devices(), 4)
+        # Both hubs take 0.2 seconds to answer; asked one after the other that would be 0.4
+        self.assertLess(time.perf_counter() - start, 0.35)
+        self.assertEqual(self.house.requests['devices/all'], 1)
+        self.assertEqual(self.garage.requests['devices/all'], 1)
+        self.assertEqual(len(self.skill.last_diff.added), 4)
+        self.assertEqual(self.skill.catalog.get('garage light').hub, 'garage')
+
+    def test_commands_go_to_the_owning_hub(self):
+        self.skill.update_devices()
+        self.skill.handle_on_intent(Message('', {'device': 'garage light'}))
+        self.skill.handle_level_intent(Message('', {'device': 'kitchen light', 'level': '40'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.garage.commands, [('1', 'on', None)])
+        self.assertEqual(self.house.commands, [('1', 'setLevel', '40')])
+
+    def test_group_spans_hubs(self):
+        self.skill.update_devices()
+        self.skill.handle_group_off_intent(Message('', {'group': 'lights'}))
+        self.assertEqual(sorted(c[0] for c in self.house.commands), ['1', '2'])
+        self.assertEqual(self.garage.commands, [('1', 'off', None)])
+
+    def test_hub_that_does_not_answer_keeps_its_devices(self):
+        self.skill.update_devices()
+        self.garage.failure_rate = 1.0
+        self.house.add_device(3, 'porch light')
+        self.assertEqual(self.skill.update_devices(quiet=True), 5)
+        self.assertEqual(self.skill.last_diff.added, ['porch light'])
+        self.assertIsNotNone(self.skill.catalog.get('workbench outlet'))
+
+    def test_hub_that_does_not_resolve_leaves_the_others_working(self):
+        self.skill.settings['hubs'].append({'name': 'shed', 'local_address': 'shed.invalid',
+                                            'hubitat_maker_api_app_id': '30', 'access_token': 'shed-token'})
+        with patch.object(self.skill, 'schedule_catalog_refresh'), \
+                patch.object(self.skill, 'schedule_health_probe'):
+            self.skill.on_settings_changed()
+        self.assertTrue(self.skill.configured)
+        self.assertEqual(self.skill.hubs['shed'].address, 'shed.invalid')
+        self.assertEqual(self.skill.update_devices(quiet=True), 4)
+        self.skill.handle_on_intent(Message('', {'device': 'garage light'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.garage.commands, [('1', 'on', None)])
+
+    def test_snapshot_restores_both_shards(self):
+        self.skill.update_devices()
+        with open(path.join(self.skill.file_system.path, 'catalog.json')) as f:
+            snapshot = json.load(f)
+        catalog = DeviceCatalog.from_snapshot(snapshot, self.skill.snapshot_hub)
+        self.assertEqual(sorted(catalog.split()), ['garage', 'house'])
+
+    def test_events_are_kept_per_hub(self):
+        # Each hub posts its events to its own path; the root path is the first hub.  Both are on this
+        # machine, which is where the events have to come from.
+        self.assertEqual(self.skill.hub_hosts(), {'house': '127.0.0.1', 'garage': '127.0.0.1'})
+        self.skill.start_event_listener(free_port())
+        port = self.skill.event_listener.port
+        for hub_path, value in (('/garage', 'on'), ('/', 'off')):
+            body = json.dumps({'content': {'deviceId': '1', 'name': 'switch', 'value': value}}).encode()
+            urlopen(Request(f"http://127.0.0.1:{port}{hub_path}", data=body), timeout=2).read()
+        self.assertEqual(self.skill.attr_store.get('1', 'switch', 'garage'), (True, 'on'))
+        self.assertEqual(self.skill.attr_store.get('1', 'switch', 'house'), (True, 'off'))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import sys
+import time
+import unittest
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import path
+from threading import Lock
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill.catalog import Device, DeviceCatalog, TEST_DEVICES
+from hubitat_integration_skill.routines import Routine, parse_routines, parse_step
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+DEVICES = [
+    {'id': 1, 'label': 'living room lamp', 'commands': ['on', 'off', 'setLevel'], 'room': 'Living Room'},
+    {'id': 2, 'label': 'kitchen light', 'commands': ['on', 'off'], 'room': 'Kitchen'},
+    {'id': 3, 'label': 'thermostat', 'commands': ['setThermostatMode'], 'capabilities': ['Thermostat'],
+     'attributes': {'supportedThermostatModes': '[heat, cool, off]'}},
+    {'id': 4, 'label': 'porch light', 'commands': ['on', 'off']},
+]
+
+
+def catalog():
+    devices = [Device(str(d['id']), d['label'], d['commands'], d.get('capabilities', ()), d.get('attributes'))
+               for d in DEVICES]
+    return DeviceCatalog(list(TEST_DEVICES) + devices, min_score=65)
+
+
+def modes(device):
+    return ['heat', 'cool', 'off'] if device.label == 'thermostat' else []
+
+
+class TestParsing(unittest.TestCase):
+    def test_steps(self):
+        self.assertEqual(parse_step("Dim the living room lamp to 20%"),
+                         {'device': 'living room lamp', 'command': None, 'value': '20', 'after': []})
+        self.assertEqual(parse_step("turn off kitchen light"),
+                         {'device': 'kitchen light', 'command': 'off', 'value': None, 'after': []})
+        self.assertEqual(parse_step("then turn the porch light on"),
+                         {'device': 'porch light', 'command': 'on', 'value': None, 'after': ['previous']})
+        self.assertIsNone(parse_step("make popcorn"))
+
+    def test_text_and_dict_settings(self):
+        routines = parse_routines("movie time: dim living room lamp to 20, turn off kitchen light; bed: make tea")
+        self.assertEqual(list(routines), ['movie time', 'bed'])
+        self.assertEqual(len(routines['movie time']), 2)
+        self.assertIn('problem', routines['bed'][0])
+        routines = parse_routines({'away': [{'device': 'porch light', 'command': 'on'}, "turn off kitchen light"]})
+        self.assertEqual(routines['away'][0]['command'], 'on')
+
+
+class TestCompile(unittest.TestCase):
+    def test_resolves_devices_and_commands(self):
+        specs = parse_routines("movie: dim living room lamp to 20, turn off kitchen lights, set thermostat to cool, "
+                               "set kitchen light to 50, turn on garage door")['movie']
+        routine = Routine.compile('movie', specs, catalog(), modes)
+        self.assertEqual([(s.device.id, s.command, s.value) for s in routine.steps],
+                         [('1', 'setLevel', '20'), ('2', 'off', None), ('3', 'setThermostatMode', 'cool')])
+        self.assertEqual(len(routine.problems), 2)
+
+    def test_dependencies(self):
+        specs = parse_routines("r: turn off living room lamp, turn on porch light, then turn on kitchen light, "
+                               "set living room lamp to 40")['r']
+        routine = Routine.compile('r', specs, catalog(), modes)
+        self.assertEqual([s.after for s in routine.steps], [(), (), (1,), (0,)])
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.pool = ThreadPoolExecutor(8)
+        self.started = []
+        self.lock = Lock()
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def submit(self, fail=()):
+        def send(step):
+            with self.lock:
+                self.started.append((step.index, time.perf_counter()))
+            time.sleep(0.1)
+            return None if step.device.label in fail else "ok"
+        return lambda step: self.pool.submit(send, step)
+
+    def test_independent_steps_run_together(self):
+        specs = parse_routines("r: turn off living room lamp, turn off kitchen light, turn off porch light, "
+                               "then set living room lamp to 30")['r']
+        routine = Routine.compile('r', specs, catalog(), modes)
+        start = time.perf_counter()
+        results = routine.run(self.submit(), timeout=2)
+        elapsed = time.perf_counter() - start
+        self.assertTrue(all(r.ok for r in results))
+        # Three steps at once, then the one that waits: two rounds, not four
+        self.assertLess(elapsed, 0.35)
+        started = dict(self.started)
+        self.assertGreaterEqual(started[3] - min(started[0], started[2]), 0.09)
+
+    def test_failure_skips_what_waits_for_it(self):
+        specs = parse_routines("r: turn off kitchen light, then turn on porch light, turn off living room lamp")['r']
+        routine = Routine.compile('r', specs, catalog(), modes)
+        results = routine.run(self.submit(fail=('kitchen light',)), timeout=2)
+        self.assertEqual([(r.ok, r.skipped) for r in results], [(False, False), (False, True), (True, False)])
+        self.assertNotIn(1, dict(self.started))
+
+    def test_timeout_leaves_unfinished_steps_empty(self):
+        routine = Routine.compile('r', parse_routines("r: turn off kitchen light")['r'], catalog(), modes)
+        results = routine.run(lambda step: Future(), timeout=0.05)
+        self.assertEqual(results, [None])
+
+
+class TestRoutineIntent(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi(DEVICES, latency=0.1).start()
+        self.skill = make_skill(
+            self.hub, update=False,
+            routines="movie time: dim living room lamp to 20, turn off kitchen light, set thermostat to cool; "
+                     "leaving: turn off kitchen light, turn on garage door")
+        self.skill.refresh_catalog()
+        self.hub.reset()
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def test_run(self):
+        start = time.perf_counter()
+        self.skill.handle_routine_intent(Message('', {'routine': 'movie time'}))
+        self.assertLess(time.perf_counter() - start, 0.25)
+        self.assertEqual(sorted(self.hub.commands),
+                         [('1', 'setLevel', '20'), ('2', 'off', None), ('3', 'setThermostatMode', 'cool')])
+        self.skill.speak_dialog.assert_called_once_with('routine.ok', data={'routine': 'movie time', 'count': 3})
+
+    def test_partial(self):
+        self.skill.handle_routine_intent(Message('', {'routine': 'leaving'}))
+        self.skill.speak_dialog.assert_called_once_with('routine.partial',
+                                                        data={'routine': 'leaving', 'count': 2, 'failed': 1})
+
+    def test_compiled_once_per_catalog(self):
+        routines = self.skill.compiled_routines()
+        self.assertIs(self.skill.compiled_routines(), routines)
+        self.hub.add_device(5, 'garage door', commands=['on', 'off'])
+        self.skill.update_devices()
+        self.assertEqual(self.skill.compiled_routines()['leaving'].problems, [])
+
+    def test_unknown(self):
+        self.skill.handle_routine_intent(Message('', {'routine': 'party'}))
+        self.skill.speak_dialog.assert_called_once_with('routine.not.found', data={'routine': 'party'})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from threading import Event
+from unittest.mock import Mock
+
+from hubitat_integration_skill.singleflight import SingleFlight
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill  # noqa: E402
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_overlapping_calls_share_one(self):
+        flight = SingleFlight()
+        release = Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            release.wait(2)
+            return 42
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flight.do, 'key', slow) for _ in range(4)]
+            while len(flight) == 0:
+                time.sleep(0.01)
+            time.sleep(0.05)
+            release.set()
+            results = [f.result() for f in futures]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [(42, False)] + [(42, True)] * 3)
+        self.assertEqual(len(flight), 0)
+
+    def test_calls_after_the_first_ends_are_new(self):
+        flight = SingleFlight()
+        func = Mock(side_effect=[1, 2])
+        self.assertEqual(flight.do('key', func), (1, False))
+        self.assertEqual(flight.do('key', func), (2, False))
+
+    def test_exception_reaches_everyone(self):
+        flight = SingleFlight()
+        release = Event()
+
+        def broken():
+            release.wait(2)
+            raise ValueError("no")
+
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(flight.do, 'key', broken) for _ in range(2)]
+            time.sleep(0.05)
+            release.set()
+            for future in futures:
+                self.assertIsInstance(future.exception(2), ValueError)
+
+
+class TestSharedHubRequests(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi([{'id': 1, 'label': 'thermostat', 'attributes': {'temperature': '68'}}],
+                                latency=0.2).start()
+        self.skill = make_skill(self.hub, update=False, attribute_cache_ttl=0)
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def test_concurrent_rescans_download_once(self):
+        with ThreadPoolExecutor(3) as pool:
+            counts = list(pool.map(lambda _: self.skill.update_devices(), range(3)))
+        self.assertEqual(counts, [1, 1, 1])
+        self.assertEqual(self.hub.requests['devices/all'], 1)
+
+    def test_rescan_that_joins_a_quiet_refresh_reports_a_failure(self):
+        self.hub.failure_rate = 1.0
+        self.skill.metrics.enabled = True
+        with ThreadPoolExecutor(1) as pool:
+            background = pool.submit(self.skill.update_devices, quiet=True)
+            time.sleep(0.05)
+            self.assertEqual(self.skill.update_devices(), 0)
+            background.result(2)
+        self.assertEqual(self.skill.metrics.snapshot()['counters']['catalog.refresh.shared'], 1)
+        self.skill.speak_dialog.assert_called_once_with('url.error')
+
+    def test_concurrent_attribute_reads_fetch_once(self):
+        self.skill.update_devices()
+        self.hub.reset()
+        with ThreadPoolExecutor(3) as pool:
+            values = list(pool.map(lambda _: self.skill.hub_get_attribute('1', 'temperature'), range(3)))
+        self.assertEqual(values, ['68'] * 3)
+        self.assertEqual(self.hub.requests['devices/<id>'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
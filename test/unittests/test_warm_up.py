@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+from os import path
+from threading import Thread
+from unittest.mock import patch
+
+from mycroft.messagebus.message import Message
+
+from hubitat_integration_skill import HubitatIntegration
+
+TEST_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, TEST_DIR)
+from fake_maker_api import FakeMakerApi  # noqa: E402
+from skill_harness import make_skill, start_skill  # noqa: E402
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_loading_the_skill_leaves_the_heavy_modules_alone(self):
+        # In a fresh interpreter, as the skill loader would see it
+        code = (f"import sys; sys.path.insert(0, {TEST_DIR!r}); import mycroft_stub; mycroft_stub.install(); "
+                "import hubitat_integration_skill; "
+                "print(sorted(m for m in ('requests', 'fuzzywuzzy', 'http.server') if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=os.environ,
+                                check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+        self.assertIsNotNone(HubitatIntegration.import_seconds)
+
+
+class TestWarmUp(unittest.TestCase):
+    def setUp(self):
+        self.hub = FakeMakerApi([{'id': 1, 'label': 'kitchen light', 'commands': ['on', 'off']}]).start()
+        self.skill = make_skill(self.hub, start=False)
+
+    def tearDown(self):
+        self.skill.shutdown()
+        self.hub.stop()
+
+    def slow_dns(self, seconds):
+        resolve = self.skill.address_cache.resolve
+
+        def slow(*args, **kwargs):
+            time.sleep(seconds)
+            return resolve(*args, **kwargs)
+        return patch.object(self.skill.address_cache, 'resolve', side_effect=slow)
+
+    def test_initialize_does_not_wait_for_the_hub(self):
+        with self.slow_dns(0.3), patch.object(self.skill, 'schedule_catalog_refresh'):
+            start = time.perf_counter()
+            self.skill.initialize()
+            self.assertLess(time.perf_counter() - start, 0.1)
+            self.assertFalse(self.skill.warmed_up.is_set())
+            self.assertTrue(self.skill.warmed_up.wait(5))
+        self.assertTrue(self.skill.configured)
+
+    def test_early_intent_waits_for_the_warm_up(self):
+        with self.slow_dns(0.2), patch.object(self.skill, 'schedule_catalog_refresh'):
+            self.skill.initialize()
+            # The catalog arrives with the first scheduled refresh
+            Thread(target=lambda: self.skill.warmed_up.wait(5) and self.skill.refresh_catalog()).start()
+            self.skill.handle_on_intent(Message('', {'device': 'kitchen light'}))
+        self.skill.command_queue.drain()
+        self.assertEqual(self.hub.commands, [('1', 'on', None)])
+
+    def test_snapshot_is_loaded_during_the_warm_up(self):
+        start_skill(self.skill)
+        self.skill.update_devices()
+        restarted = make_skill(self.hub, start=False)
+        restarted.file_system = self.skill.file_system
+        start_skill(restarted)
+        try:
+            self.assertTrue(restarted.catalog_ready.is_set())
+            self.assertEqual(restarted.dev_id_dict['kitchen light'], '1')
+        finally:
+            restarted.shutdown()
+
+    def test_startup_times_are_recorded(self):
+        self.skill.settings['enable_metrics'] = True
+        start_skill(self.skill)
+        latency = self.skill.metrics.snapshot()['latency']
+        for name in ('skill.import', 'skill.initialize', 'skill.warm_up'):
+            self.assertEqual(latency[name]['count'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()